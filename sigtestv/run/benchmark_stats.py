@@ -0,0 +1,166 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from sigtestv.stats import ecdf, ecdf_batch, pos_mean_ecdf, compute_pr_x_ge_y, compute_pr_x_ge_y_batch, \
+    MeanMaxEstimator, QuantileMaxEstimator, QuantileEstimator, iter_ecdf_distances, compute_ks_distance, \
+    compute_ks_distance_batch, maximum_cdf_error, maximum_cdf_error_batch
+
+
+def ecdf_loop(sample: np.ndarray, equality=True):
+    cdf = []
+    n = len(sample)
+    next_sample = np.concatenate((sample[1:], [None]))
+    last_prob = 0
+    for idx, (s, next_s) in enumerate(zip(sample, next_sample)):
+        if s != next_s:
+            prob = (idx + 1) / n if equality else last_prob
+            last_prob = (idx + 1) / n
+            cdf.append(prob)
+    if equality:
+        cdf.append(1)
+    return np.unique(cdf), np.unique(sample)
+
+
+def compute_pr_x_ge_y_loop(x, y):
+    x = [(x_, 0) for x_ in x]
+    y = [(y_, 1) for y_ in y]
+    z = sorted(y + x, key=lambda e: e[0])
+    counter = 0
+    results = []
+    for idx, (elem, lab) in enumerate(z):
+        counter += lab
+        results.append(counter * (1 - lab))
+    return np.sum(results) / (len(x) * len(y))
+
+
+def report(name, baseline_fn, fast_fn, number):
+    baseline = timeit.timeit(baseline_fn, number=number) / number
+    fast = timeit.timeit(fast_fn, number=number) / number
+    print(f'{name:<30} baseline: {1000 * baseline:<10.3f}ms fast: {1000 * fast:<10.3f}ms speedup: {baseline / fast:.1f}x')
+
+
+def bench_ecdf(args):
+    sample = np.sort(np.round(np.random.rand(args.sample_size), 3))
+    samples = np.sort(np.random.choice(sample, (args.batch_size, len(sample))), 1)
+    for equality in (True, False):
+        cdf1, s1 = ecdf_loop(sample, equality=equality)
+        cdf2, s2 = ecdf(sample, equality=equality)
+        assert np.allclose(cdf1, cdf2) and np.array_equal(s1, s2)
+    n = len(sample)
+    expected = [pos_mean_ecdf(ecdf_loop(s)[0] ** n, np.unique(s)) for s in samples]
+    cdf, _ = ecdf_batch(samples)
+    assert np.allclose(expected, pos_mean_ecdf(cdf ** n, samples))
+
+    report('ecdf', lambda: ecdf_loop(sample), lambda: ecdf(sample), args.number)
+    report(f'ecdf x{args.batch_size}',
+           lambda: [ecdf_loop(s) for s in samples],
+           lambda: ecdf_batch(samples),
+           max(1, args.number // 10))
+
+
+def bench_pr_x_ge_y(args):
+    x = np.round(np.random.rand(args.sample_size), 3)
+    y = np.round(np.random.rand(args.sample_size), 3)
+    xs = np.random.choice(x, (args.batch_size, len(x)))
+    ys = np.random.choice(y, (args.batch_size, len(y)))
+    assert compute_pr_x_ge_y_loop(x, y) == compute_pr_x_ge_y(x, y)
+    assert np.allclose([compute_pr_x_ge_y_loop(a, b) for a, b in zip(xs, ys)], compute_pr_x_ge_y_batch(xs, ys))
+
+    report('compute_pr_x_ge_y', lambda: compute_pr_x_ge_y_loop(x, y), lambda: compute_pr_x_ge_y(x, y), args.number)
+    report(f'compute_pr_x_ge_y x{args.batch_size}',
+           lambda: [compute_pr_x_ge_y_loop(a, b) for a, b in zip(xs, ys)],
+           lambda: compute_pr_x_ge_y_batch(xs, ys),
+           max(1, args.number // 10))
+
+
+def bootstrap_ci_loop(sample, estimate_fn, alpha=0.05, ci_samples=2000):
+    est = estimate_fn(sample)
+    bs_estimates = [estimate_fn(np.random.choice(sample, len(sample))) for _ in range(ci_samples)]
+    return est, tuple(np.quantile(bs_estimates, (alpha / 2, 1 - alpha / 2)))
+
+
+def bench_bootstrap(args):
+    sample = np.random.rand(args.sample_size)
+    samples = np.random.choice(sample, (args.batch_size, len(sample)))
+    for estimator in (MeanMaxEstimator(), QuantileMaxEstimator(), QuantileEstimator()):
+        assert np.allclose([estimator.estimate_point(x) for x in samples], estimator.estimate_point_batch(samples))
+        ci_samples = estimator.options['ci_samples']
+        report(f'{estimator.name[:20]} CI x{ci_samples}',
+               lambda: bootstrap_ci_loop(sample, estimator.estimate_point, ci_samples=ci_samples),
+               lambda: estimator.estimate_interval(sample),
+               max(1, args.number // 10))
+
+
+def compute_ks_distance_loop(ecdf1, sample1, ecdf2, sample2):
+    max_dist = 0
+    max_val = 0
+    for dist, val, _, _, _ in iter_ecdf_distances(ecdf1, sample1, ecdf2, sample2):
+        if dist > max_dist:
+            max_dist = dist
+            max_val = val
+    return max_val, max_dist
+
+
+def maximum_pointwise_cdf_error_loop(x0, y0):
+    if x0 < y0:
+        x0, y0 = y0, x0
+    if x0 == 1 and x0 > y0:
+        return 1
+    k = np.log(np.log(y0) / np.log(x0))
+    k = k / np.log(x0 / y0)
+    return x0 ** k - y0 ** k
+
+
+def maximum_cdf_error_loop(ecdf1, sample1, ecdf2, sample2):
+    # Points where the smaller CDF is 0 or both are equal have no finite stationary point and are skipped
+    return max((maximum_pointwise_cdf_error_loop(x0, y0)
+                for _, _, _, x0, y0 in iter_ecdf_distances(ecdf1, sample1, ecdf2, sample2)
+                if min(x0, y0) > 0 and x0 != y0), default=0)
+
+
+def bench_distance(args):
+    # The stepwise merge only lines up both ECDFs when they share a support, so compare on CDF bands of one sample
+    cdf, sample = ecdf(np.sort(np.random.rand(args.sample_size)))
+    lcdf = np.clip(cdf - np.random.rand(len(cdf)) * 0.05, 0, 1)
+    assert np.allclose(compute_ks_distance_loop(cdf, sample, lcdf, sample), compute_ks_distance(cdf, sample, lcdf, sample))
+    assert np.isclose(maximum_cdf_error_loop(cdf, sample, lcdf, sample), maximum_cdf_error(cdf, sample, lcdf, sample))
+    samples = np.sort(np.random.choice(sample, (args.batch_size, len(sample))), 1)
+    cdfs, _ = ecdf_batch(samples)
+    expected = [compute_ks_distance(*ecdf(x), cdf, sample)[1] for x in samples]
+    assert np.allclose(expected, compute_ks_distance_batch(cdfs, samples, cdf, sample)[1])
+    # The band must be a step function of the sample, so the offset only depends on the value and not on ties
+    lcdfs = np.clip(cdfs - samples * 0.05, 0, 1)
+    expected = [maximum_cdf_error(c, x, l, x) for c, l, x in zip(cdfs, lcdfs, samples)]
+    assert np.allclose(expected, maximum_cdf_error_batch(cdfs, samples, lcdfs, samples))
+
+    report('compute_ks_distance',
+           lambda: compute_ks_distance_loop(cdf, sample, lcdf, sample),
+           lambda: compute_ks_distance(cdf, sample, lcdf, sample),
+           args.number)
+    report(f'compute_ks_distance x{args.batch_size}',
+           lambda: [compute_ks_distance(*ecdf(x), cdf, sample) for x in samples],
+           lambda: compute_ks_distance_batch(cdfs, samples, cdf, sample),
+           max(1, args.number // 10))
+
+
+BENCHMARKS = dict(ecdf=bench_ecdf, pr_x_ge_y=bench_pr_x_ge_y, bootstrap=bench_bootstrap, distance=bench_distance)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmarks', '-b', type=str, nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--sample-size', '-s', type=int, default=1000)
+    parser.add_argument('--batch-size', '-bs', type=int, default=500)
+    parser.add_argument('--number', '-n', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    for name in args.benchmarks:
+        BENCHMARKS[name](args)
+
+
+if __name__ == '__main__':
+    main()
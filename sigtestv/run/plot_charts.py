@@ -4,7 +4,6 @@ import argparse
 import json
 
 from matplotlib import pyplot as plt
-from tqdm import trange
 from scipy.stats import gaussian_kde
 import numpy as np
 import pandas as pd
@@ -21,23 +20,14 @@ def plot_max(ax,
              **estimator_kwargs):
     if total is None:
         total = len(results)
-    y = []
-    x2 = []
-    x3 = []
-    pa = []
-    p50 = []
     estimator_kwargs['quantile'] = 0.1
-    for idx in trange(total):
-        estimator_kwargs['n'] = idx + 1
-        mme = MeanMaxEstimator(options=estimator_kwargs)
-        budget_kwargs = estimator_kwargs.copy()
-        fe = ForwardEstimator(options=budget_kwargs)
-        options = estimator_kwargs.copy()
-        be = BackwardEstimator(options=options)
-
-        y.append(mme.estimate_point(results))
-        x2.append(fe.estimate_point(results))
-        x3.append(be.estimate_point(results))
+    ns = np.arange(total) + 1
+    mme = MeanMaxEstimator(options=estimator_kwargs.copy())
+    fe = ForwardEstimator(options=estimator_kwargs.copy())
+    be = BackwardEstimator(options=estimator_kwargs.copy())
+    y = mme.estimate_curve(results, ns)
+    x2 = fe.estimate_curve(results, ns)
+    x3 = be.estimate_curve(results, ns)
     x = scale_factor * (np.arange(total) + 1)
     if plot_type == 'mean':
         ax.plot(x, y, label=f'{name} {mme.name}')
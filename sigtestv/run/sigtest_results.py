@@ -21,6 +21,11 @@ def main():
     parser.add_argument('--asd-threshold', '--asd-th', type=float, default=0.5)
     parser.add_argument('--test', type=str, default='power', choices=['power', 'type1'])
     parser.add_argument('--quantile', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--early-stop', action='store_true')
+    parser.add_argument('--early-stop-width', type=float, default=0.02)
+    parser.add_argument('--early-stop-threshold', type=float)
     parser.add_argument('--quantity',
                         type=str,
                         default='stochastic-order',
@@ -48,6 +53,9 @@ def main():
         tests = (q_test_hd, q_test_direct)
         order_fn = partial(order_quantile, quantile=args.quantile)
 
+    early_stop_kwargs = dict(early_stop=args.early_stop,
+                             early_stop_width=args.early_stop_width,
+                             early_stop_threshold=args.early_stop_threshold)
     pop_x = pd.read_csv(args.files[0], sep='\t', quoting=3)[args.result_column_name]
     if args.test == 'power':
         pop_y = pd.read_csv(args.files[1], sep='\t', quoting=3)[args.result_column_name2]
@@ -58,18 +66,29 @@ def main():
                                                       n2=args.num_samples2,
                                                       iters=args.num_iters,
                                                       alpha=args.alpha,
-                                                      order_fn=order_fn)
+                                                      order_fn=order_fn,
+                                                      workers=args.workers,
+                                                      seed=args.seed,
+                                                      **early_stop_kwargs)
     else:
         pop_single = ResultPopulationSingle(pop_x)
         results = pop_single.simulate_type1_error(args.num_samples,
                                                   tests,
                                                   use_tqdm=True,
                                                   iters=args.num_iters,
-                                                  alpha=args.alpha)
+                                                  alpha=args.alpha,
+                                                  workers=args.workers,
+                                                  seed=args.seed,
+                                                  **early_stop_kwargs)
 
-    print('name\tresult')
-    for test_name, result in results.items():
-        print(f'{test_name}\t{result:.4f}')
+    if args.early_stop:
+        print('name\tresult\titers')
+        for test_name, result in results.items():
+            print(f'{test_name}\t{result:.4f}\t{results.test_iters[test_name]}')
+    else:
+        print('name\tresult')
+        for test_name, result in results.items():
+            print(f'{test_name}\t{result:.4f}')
 
 
 if __name__ == '__main__':
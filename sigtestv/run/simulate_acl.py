@@ -1,4 +1,3 @@
-from functools import partial
 import argparse
 import sys
 
@@ -7,47 +6,67 @@ from scipy import stats
 from tqdm import tqdm, trange
 import numpy as np
 
-from sigtestv.stats import MeanMaxEstimator, dkde_from_sample_rvs
+from sigtestv.stats import MeanMaxEstimator, QuantileEstimator, QuantileMaxEstimator, bootstrap_ci, \
+    dkde_from_sample_rvs, expected_max, expected_max_curve, population_quantile, quantile_max
+from sigtestv.utils import set_cache_dir
 
 
 def make_tnorm_rvs(loc, scale, c: float = 0, d: float = 1):
     a = (c - loc) / scale
     b = (d - loc) / scale
-    return partial(stats.truncnorm.rvs, loc=loc, scale=scale, a=a, b=b)
+    return stats.truncnorm(a, b, loc=loc, scale=scale).rvs
 
 
 def make_texpon_rvs(loc, scale, d: float = 1):
     b = (d - loc) / scale
-    return partial(stats.truncexpon.rvs, loc=loc, scale=scale, b=b)
+    return stats.truncexpon(b, loc=loc, scale=scale).rvs
+
+
+ESTIMATORS = dict(meanmax=MeanMaxEstimator, quantile=QuantileEstimator, quantilemax=QuantileMaxEstimator)
+
+
+def compute_true_parameter(args, gen_fn, k):
+    if args.estimator == 'meanmax':
+        return expected_max(gen_fn, k)
+    elif args.estimator == 'quantile':
+        return population_quantile(gen_fn, args.quantile)
+    elif args.estimator == 'quantilemax':
+        return quantile_max(gen_fn, k, q=args.quantile)
 
 
 def simulate_bs(args, estimator_cls, gen_fn, header):
     k = args.subsample_size
-    mme = estimator_cls(options=dict(n=k))
-    true_samples = []
-    for _ in range(10):
-        maximums = np.max(gen_fn(size=(k, 100000)), 0)
-        true_samples.extend(maximums)
-    true_param = np.mean(true_samples)
+    options = dict(n=k, ci_method=args.ci_method)
+    if args.estimator != 'meanmax':
+        options['quantile'] = args.quantile
+    mme = estimator_cls(options=options)
+    true_param = compute_true_parameter(args, gen_fn, k)
     results = []
+    replicates = []
     for _ in trange(args.num_iters):
-        _, (l, u) = mme.estimate_interval(gen_fn(size=args.sample_size))
+        sample = gen_fn(size=args.sample_size)
+        if args.adaptive_bs:
+            _, (l, u), num_replicates = bootstrap_ci(sample,
+                                                     mme.estimate_point,
+                                                     method=args.ci_method,
+                                                     ci_samples=args.bs_batch_size,
+                                                     batch_estimate_fn=mme.estimate_point_batch,
+                                                     adaptive=True,
+                                                     tol=args.bs_tol,
+                                                     **mme.resampling_kwargs())
+            replicates.append(num_replicates)
+        else:
+            _, (l, u) = mme.estimate_interval(sample)
         results.append(int(l <= true_param <= u))
     tqdm.write(f'{header} (k={k}): {100 * np.mean(results):.2f}')
+    if args.adaptive_bs:
+        tqdm.write(f'{header} (k={k}) bootstrap replicates: {np.mean(replicates):.1f}')
 
 
 def simulate_mme_test(args, estimator_cls, gen_fn1, gen_fn2):
     for n in trange(1, args.sample_size + 1):
-        true_samples = []
-        for _ in range(10):
-            maximums = np.max(gen_fn1(size=(n, 100000)), 0)
-            true_samples.extend(maximums)
-        true_param1 = np.mean(true_samples)
-        true_samples = []
-        for _ in range(10):
-            maximums = np.max(gen_fn2(size=(n, 100000)), 0)
-            true_samples.extend(maximums)
-        # true_param2 = np.mean(true_samples)
+        true_param1 = expected_max(gen_fn1, n)
+        # true_param2 = expected_max(gen_fn2, n)
 
         mme = estimator_cls(options=dict(n=n))
         name = mme.name
@@ -77,26 +96,14 @@ def simulate_mme_test(args, estimator_cls, gen_fn1, gen_fn2):
 
 
 def simulate_mme(args, estimator_cls, gen_fn, header, ax, plot_range=False):
-    y = []
-    y_p25 = []
-    y_p75 = []
-    y_true = []
     x = list(range(1, args.subsample_size + 1))
-    for k in tqdm(x):
-        true_samples = []
-        for _ in range(10):
-            maximums = np.max(gen_fn(size=(k, 100000)), 0)
-            true_samples.extend(maximums)
-        true_param = np.mean(true_samples)
-        y_true.append(true_param)
-        mme = estimator_cls(options=dict(n=k))
-        name = mme.name
-        estimates = []
-        for _ in range(args.num_iters):
-            estimates.append(mme.estimate_point(gen_fn(size=args.sample_size)))
-        y.append(np.mean(estimates))
-        y_p25.append(np.quantile(estimates, 0.25))
-        y_p75.append(np.quantile(estimates, 0.75))
+    y_true = expected_max_curve(gen_fn, x)
+    mme = estimator_cls()
+    name = mme.name
+    estimates = np.array([mme.estimate_curve(gen_fn(size=args.sample_size), x) for _ in trange(args.num_iters)])
+    y = np.mean(estimates, 0)
+    y_p25 = np.quantile(estimates, 0.25, axis=0)
+    y_p75 = np.quantile(estimates, 0.75, axis=0)
     p = ax.plot(x, y, label=f'{name} ({header})')
     if plot_range:
         c = p[-1].get_color()
@@ -105,21 +112,11 @@ def simulate_mme(args, estimator_cls, gen_fn, header, ax, plot_range=False):
 
 
 def export_samples(args, estimator_cls, gen_fn):
-    y = []
-    y_true = []
     x = list(range(1, args.subsample_size + 1))
-    for k in tqdm(x):
-        true_samples = []
-        for _ in range(10):
-            maximums = np.max(gen_fn(size=(k, 100000)), 0)
-            true_samples.extend(maximums)
-        true_param = np.mean(true_samples)
-        y_true.append(true_param)
-        mme = estimator_cls(options=dict(n=k))
-        estimates = []
-        for _ in range(args.num_iters):
-            estimates.append(mme.estimate_point(gen_fn(size=args.sample_size)))
-        y.append((np.mean(estimates), 1.96 * np.std(estimates) / np.sqrt(args.num_iters)))
+    y_true = expected_max_curve(gen_fn, x)
+    mme = estimator_cls()
+    estimates = np.array([mme.estimate_curve(gen_fn(size=args.sample_size), x) for _ in trange(args.num_iters)])
+    y = zip(np.mean(estimates, 0), 1.96 * np.std(estimates, 0) / np.sqrt(args.num_iters))
     print('mean,err,ytrue')
     for (mean, err), yt in zip(y, y_true):
         print(f'{mean},{err},{yt}')
@@ -131,16 +128,32 @@ def main():
     parser.add_argument('--subsample-size', '-k', type=int, default=None)
     parser.add_argument('--num-iters', '-n', type=int, default=5000)
     parser.add_argument('--use-kde', action='store_true')
+    parser.add_argument('--cache-dir', type=str)
     parser.add_argument('--action', '-a', type=str, default='mme', choices=['mme', 'bs', 'mme-test', 'export-samples'])
     parser.add_argument('--show-hist', '-sh', action='store_true')
     parser.add_argument('--correct-bias', '-cb', action='store_true')
     parser.add_argument('--multipliers', '-mult', nargs=2, type=float, default=(1, 1))
     parser.add_argument('--swapped', action='store_true')
+    parser.add_argument('--ci-method',
+                        type=str,
+                        default='percentile-bootstrap',
+                        choices=['percentile-bootstrap', 'reverse-bootstrap', 'direct', 'analytic', 'jackknife'])
+    parser.add_argument('--estimator', type=str, default='meanmax', choices=list(ESTIMATORS))
+    parser.add_argument('--quantile', '-q', type=float, default=0.5)
+    parser.add_argument('--adaptive-bs', action='store_true')
+    parser.add_argument('--bs-batch-size', type=int, default=500)
+    parser.add_argument('--bs-tol', type=float, default=0.01)
     args = parser.parse_args()
 
+    if args.adaptive_bs and args.ci_method not in ('percentile-bootstrap', 'reverse-bootstrap'):
+        parser.error('--adaptive-bs only applies to the bootstrap CI methods')
+    if args.estimator == 'quantilemax' and args.ci_method in ('analytic', 'jackknife'):
+        parser.error(f'--ci-method {args.ci_method} is not supported for the quantilemax estimator')
     if args.subsample_size is None:
         args.subsample_size = args.sample_size
 
+    if args.cache_dir is not None:
+        set_cache_dir(args.cache_dir)
     if args.use_kde:
         results = list(sys.stdin)
         split_idx = results.index('\n')
@@ -172,8 +185,8 @@ def main():
         plt.legend()
         plt.show()
     elif args.action == 'bs':
-        simulate_bs(args, MeanMaxEstimator, gen_fn1, 'Small')
-        simulate_bs(args, MeanMaxEstimator, gen_fn2, 'Big')
+        simulate_bs(args, ESTIMATORS[args.estimator], gen_fn1, 'Small')
+        simulate_bs(args, ESTIMATORS[args.estimator], gen_fn2, 'Big')
     elif args.action == 'mme-test':
         simulate_mme_test(args, MeanMaxEstimator, gen_fn1, gen_fn2)
     elif args.action == 'export-samples':
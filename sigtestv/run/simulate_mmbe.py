@@ -1,5 +1,4 @@
 from collections import defaultdict
-from functools import partial, lru_cache
 import argparse
 import sys
 
@@ -7,14 +6,9 @@ from matplotlib import pyplot as plt
 from tqdm import trange, tqdm
 import numpy as np
 import scipy.stats as stats
-import statsmodels.api as sm
 
-from sigtestv.stats import ForwardEstimator, BackwardEstimator, dfromc_rvs, MeanMaxEstimator, WrappedObject, id_wrap, ecdf
-
-
-@lru_cache(maxsize=100000)
-def cached_point_estimate(wrapped_pop: WrappedObject, n):
-    return MeanMaxEstimator(options=dict(n=n, sorted=True)).estimate_point(wrapped_pop.x)
+from sigtestv.stats import ForwardEstimator, BackwardEstimator, dkde_from_sample_rvs, expected_max, forward_budget
+from sigtestv.utils import set_cache_dir
 
 
 def main():
@@ -26,35 +20,30 @@ def main():
     # parser.add_argument('--dataset-size', '-dsz', type=int, required=True)
     parser.add_argument('--begin-index', '-bi', type=int, default=0)
     parser.add_argument('--use-kde', action='store_true')
+    parser.add_argument('--cache-dir', type=str)
     parser.add_argument('--alpha', type=float, default=0.95)
     parser.add_argument('--step-size', '-ss', type=int, default=1)
     # parser.add_argument('--power', '-k', type=float, nargs=2)
     args = parser.parse_args()
 
+    if args.cache_dir is not None:
+        set_cache_dir(args.cache_dir)
     alpha = args.alpha
     metric_data = (defaultdict(list), defaultdict(list))
     if args.use_kde:
         results = np.array(list(sys.stdin), dtype=float)
-        kde = sm.nonparametric.KDEUnivariate(results)
-        kde.fit()
-        pmf = kde.cdf[1:] - kde.cdf[:-1]
-        pmf = pmf / pmf.sum()
-        rvs_gen = partial(np.random.choice, kde.support[:-1], p=pmf)
+        rvs_gen = dkde_from_sample_rvs(results)
     else:
-        rvs_gen = partial(stats.uniform.rvs)
+        rvs_gen = stats.uniform().rvs
         # rvs_gen = partial(np.random.choice, np.arange(2))
         # rvs_gen = partial(stats.truncnorm.rvs, loc=0.5, a=-3, b=2)
         # rvs_gen = partial(stats.norm.rvs, loc=0.5)
-    print('Sampling population...', file=sys.stderr)
-    pop1 = np.sort(rvs_gen(size=2000000))
-    pop2 = np.sort(rvs_gen(size=2000000))
     print('Plotting...', file=sys.stderr)
-    wpop = id_wrap(pop1)
     plt.hist(rvs_gen(size=50000), bins=1000)
     plt.show()
     for n in trange(args.begin_index + 1, args.num_samples + 1, args.step_size):
-        true_param = ForwardEstimator(options=dict(n=n, alpha=alpha, sorted=True, ceil=False)).estimate_point(pop1)
-        true_val = MeanMaxEstimator(options=dict(n=true_param, sorted=True)).estimate_point(pop2)
+        true_param = forward_budget(rvs_gen, n, alpha=alpha)
+        true_val = expected_max(rvs_gen, true_param)
         fes = []
         bes = []
         fes_true = []
@@ -67,8 +56,8 @@ def main():
             be_estimate = be.estimate_point(sample)
             fes.append(fe_estimate)
             bes.append(be_estimate)
-            fes_true.append(cached_point_estimate(wpop, int(fe_estimate)))
-            bes_true.append(cached_point_estimate(wpop, int(be_estimate)))
+            fes_true.append(expected_max(rvs_gen, int(fe_estimate)))
+            bes_true.append(expected_max(rvs_gen, int(be_estimate)))
         print()
         print(true_val, fes_true[-1], bes_true[-1])
         fes = np.array(fes)
@@ -7,7 +7,8 @@ from scipy import stats
 from tqdm import trange
 import numpy as np
 
-from sigtestv.stats import MeanMaxEstimator, dfromc_rvs, compute_minimum_sample_power, CorrectedMeanMaxEstimator
+from sigtestv.stats import MeanMaxEstimator, dfromc_rvs, compute_minimum_sample_power, CorrectedMeanMaxEstimator, \
+    expected_max
 
 
 def main():
@@ -16,7 +17,8 @@ def main():
     parser.add_argument('--subsample-size', '-k', type=int, default=None)
     parser.add_argument('--num-iters', '-n', type=int, default=10000)
     parser.add_argument('--dataset-size', '-dsz', type=int, default=67000)
-    parser.add_argument('--action', '-a', type=str, default='trajectory', choices=['trajectory', 'mse', 'ci'])
+    parser.add_argument('--action', '-a', type=str, default='trajectory', choices=['trajectory', 'mse', 'ci', 'vr'])
+    parser.add_argument('--ci-resampling', type=str, default='multinomial', choices=['multinomial', 'poisson'])
     parser.add_argument('--distribution-type', '-dtype', type=str, default='d', choices=['c', 'd', 'continuous', 'discrete'])
     args = parser.parse_args()
 
@@ -31,28 +33,22 @@ def main():
     else:
         gen_fn = partial(stats.norm.rvs, loc=0, scale=1)
         gen_fn = partial(stats.uniform.rvs)
-        gen_fn = partial(stats.truncnorm.rvs, a=-3, b=5, scale=0.2, loc=0.5)
+        gen_fn = stats.truncnorm(a=-3, b=5, scale=0.2, loc=0.5).rvs
 
-    large_N = 10000000
-    pop = gen_fn(size=large_N)
     estimators = [MeanMaxEstimator(dict(n=args.subsample_size)),
                   CorrectedMeanMaxEstimator(dict(n=args.subsample_size, method='subsample')),
+                  CorrectedMeanMaxEstimator(dict(n=args.subsample_size, method='exact')),
                   CorrectedMeanMaxEstimator(dict(n=args.subsample_size, method='mean'))]
-    true_parameter = CorrectedMeanMaxEstimator(dict(n=args.subsample_size, method='mean')).estimate_point(pop)
+    true_parameter = expected_max(gen_fn, args.subsample_size)
     plt.hist(gen_fn(size=100000), bins=args.dataset_size)
     plt.show()
     fig, ax = plt.subplots()
     if args.action == 'trajectory':
         for _ in trange(args.num_iters):
-            est_data = defaultdict(list)
             sample = gen_fn(size=args.sample_size)
-            for n in trange(args.subsample_size, position=1):
-                n += 1
-                for estimator in estimators:
-                    estimator.options['n'] = n
-                    est_data[estimator.name].append(estimator.estimate_point(sample))
-            for name, y in est_data.items():
-                ax.plot(np.arange(args.subsample_size) + 1, y, label=name)
+            ns = np.arange(args.subsample_size) + 1
+            for estimator in estimators:
+                ax.plot(ns, estimator.estimate_curve(sample, ns), label=estimator.name)
         ax.axhline(true_parameter)
         plt.legend()
         plt.show()
@@ -60,7 +56,8 @@ def main():
         y = []
         for _ in trange(args.num_iters):
             sample = gen_fn(size=args.sample_size)
-            _, (a, b) = MeanMaxEstimator(dict(n=args.subsample_size)).estimate_interval(sample)
+            mme = MeanMaxEstimator(dict(n=args.subsample_size, ci_resampling=args.ci_resampling))
+            _, (a, b) = mme.estimate_interval(sample)
             y.append(int(a <= true_parameter <= b))
         print(np.mean(y))
     elif args.action == 'mse':
@@ -78,6 +75,17 @@ def main():
         print('MSE')
         for name, estimates in est_data.items():
             print(name, np.mean((np.array(estimates) - true_parameter)**2))
+    elif args.action == 'vr':
+        vr_estimators = [CorrectedMeanMaxEstimator(dict(n=args.subsample_size, method='subsample', vr_methods=vr_methods))
+                         for vr_methods in (['cv'], ['av'], ['cv', 'av'])]
+        vr_factors = defaultdict(list)
+        for _ in trange(args.num_iters):
+            sample = gen_fn(size=args.sample_size)
+            for estimator in vr_estimators:
+                vr_factors[estimator.name].append(estimator.estimate_subsample(sample)[2])
+        print('Variance reduction factor')
+        for name, factors in vr_factors.items():
+            print(name, np.mean(factors))
 
 
 if __name__ == '__main__':
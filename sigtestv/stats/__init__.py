@@ -2,6 +2,10 @@ from .ci import *
 from .distance import *
 from .estimator import *
 from .max import *
+from .online import *
+from .oracle import *
+from .permutation import *
+from .sample import *
 from .simulation import *
 from .test import *
 from .utils import *
@@ -1,15 +1,144 @@
+from functools import partial
+
+from scipy.stats import norm, poisson
 import numpy as np
 
-from .utils import ecdf
+from .sample import HistogramSample
+from .utils import as_generator, ecdf
+
+
+def iter_bootstrap_indices(n, ci_samples, chunk_size=2 ** 22, rng=None):
+    rng = as_generator(rng)
+    rows = max(1, chunk_size // max(n, 1))
+    for idx in range(0, ci_samples, rows):
+        yield rng.integers(0, n, (min(rows, ci_samples - idx), n))
+
+
+POISSON_CDF = poisson.cdf(np.arange(32), 1)
+
+
+def draw_poisson_weights(shape, rng=None):
+    # Inverse-CDF Poisson(1) draws: two comparisons settle 74% of the mass and a table lookup handles the tail
+    u = as_generator(rng).random(shape)
+    weights = (u > POISSON_CDF[0]).astype(np.uint8)
+    weights += u > POISSON_CDF[1]
+    tail = u > POISSON_CDF[2]
+    weights[tail] += np.searchsorted(POISSON_CDF[2:], u[tail]).astype(np.uint8)
+    return weights
+
+
+def iter_poisson_weights(n, ci_samples, chunk_size=2 ** 22, rng=None):
+    # Each replicate is a vector of independent Poisson(1) counts per element; empty replicates are dropped
+    rng = as_generator(rng)
+    rows = max(1, chunk_size // max(n, 1))
+    for idx in range(0, ci_samples, rows):
+        weights = draw_poisson_weights((min(rows, ci_samples - idx), n), rng=rng)
+        yield weights[weights.sum(1) > 0]
+
+
+def poisson_bootstrap_estimates(sorted_sample: np.ndarray,
+                                weighted_estimate_fn,
+                                ci_samples=2000,
+                                chunk_size=2 ** 22,
+                                rng=None):
+    estimates = []
+    for weights in iter_poisson_weights(len(sorted_sample), ci_samples, chunk_size=chunk_size, rng=rng):
+        estimates.extend(weighted_estimate_fn(sorted_sample, weights))
+    return np.array(estimates)
+
+
+def histogram_bootstrap_estimates(sample: HistogramSample,
+                                  weighted_estimate_fn,
+                                  ci_samples=2000,
+                                  resampling='multinomial',
+                                  chunk_size=2 ** 22,
+                                  rng=None):
+    # Resampling the expanded sample only changes the counts: they are multinomial over the distinct values, or
+    # Poisson with the counts as means under the Poisson bootstrap
+    rng = as_generator(rng)
+    rows = max(1, chunk_size // len(sample.counts))
+    estimates = []
+    for idx in range(0, ci_samples, rows):
+        size = min(rows, ci_samples - idx)
+        if resampling == 'poisson':
+            weights = rng.poisson(sample.counts, (size, len(sample.counts)))
+            weights = weights[weights.sum(1) > 0]
+        else:
+            weights = rng.multinomial(len(sample), sample.counts / len(sample), size)
+        estimates.extend(weighted_estimate_fn(sample.unique, weights))
+    return np.array(estimates)
+
+
+def bootstrap_estimates(sample: np.ndarray,
+                        estimate_fn,
+                        ci_samples=2000,
+                        batch_estimate_fn=None,
+                        chunk_size=2 ** 22,
+                        rng=None):
+    estimates = []
+    for indices in iter_bootstrap_indices(len(sample), ci_samples, chunk_size=chunk_size, rng=rng):
+        samples = sample[indices]
+        if batch_estimate_fn is None:
+            estimates.extend(estimate_fn(x) for x in samples)
+        else:
+            estimates.extend(batch_estimate_fn(samples))
+    return np.array(estimates)
 
 
 def bootstrap_ci(sample: np.ndarray,
                  estimate_fn,
                  alpha=0.05,
                  method='percentile-bootstrap',
-                 ci_samples=2000):
+                 ci_samples=2000,
+                 batch_estimate_fn=None,
+                 chunk_size=2 ** 22,
+                 rng=None,
+                 adaptive=False,
+                 tol=0.01,
+                 max_ci_samples=20000,
+                 resampling='multinomial',
+                 weighted_estimate_fn=None):
+    # With resampling='poisson', replicates are per-element Poisson weights on the sorted sample, which
+    # weighted_estimate_fn(sorted_sample, weights) evaluates without materializing or re-sorting any resample.
+    # In adaptive mode, ci_samples replicates are drawn per batch until neither percentile endpoint moves by more
+    # than tol times the interval width, or max_ci_samples is reached; the replicate count is returned as well
+    if resampling not in ('multinomial', 'poisson'):
+        raise ValueError(f'Unknown resampling scheme {resampling}')
+    if resampling == 'poisson' and weighted_estimate_fn is None:
+        raise ValueError('Poisson resampling needs a weighted_estimate_fn')
     est = estimate_fn(sample)
-    bs_estimates = [estimate_fn(np.random.choice(sample, len(sample))) for _ in range(ci_samples)]
+    if isinstance(sample, HistogramSample) and weighted_estimate_fn is not None:
+        estimate_batch = partial(histogram_bootstrap_estimates,
+                                 sample,
+                                 weighted_estimate_fn,
+                                 resampling=resampling,
+                                 chunk_size=chunk_size,
+                                 rng=as_generator(rng))
+    elif resampling == 'poisson':
+        estimate_batch = partial(poisson_bootstrap_estimates,
+                                 np.sort(np.asarray(sample)),
+                                 weighted_estimate_fn,
+                                 chunk_size=chunk_size,
+                                 rng=as_generator(rng))
+    else:
+        estimate_batch = partial(bootstrap_estimates,
+                                 np.asarray(sample),
+                                 estimate_fn,
+                                 batch_estimate_fn=batch_estimate_fn,
+                                 chunk_size=chunk_size,
+                                 rng=as_generator(rng))
+    if adaptive:
+        bs_estimates = estimate_batch(ci_samples=min(ci_samples, max_ci_samples))
+        last_qs = np.quantile(bs_estimates, (alpha / 2, 1 - alpha / 2))
+        while len(bs_estimates) < max_ci_samples:
+            batch = estimate_batch(ci_samples=min(ci_samples, max_ci_samples - len(bs_estimates)))
+            bs_estimates = np.concatenate((bs_estimates, batch))
+            qs = np.quantile(bs_estimates, (alpha / 2, 1 - alpha / 2))
+            if np.max(np.abs(qs - last_qs)) <= tol * (qs[1] - qs[0]):
+                break
+            last_qs = qs
+    else:
+        bs_estimates = estimate_batch(ci_samples=ci_samples)
     if method == 'percentile-bootstrap':
         qa1, qa2 = np.quantile(bs_estimates, (alpha / 2, 1 - alpha / 2))
     elif method == 'reverse-bootstrap':
@@ -17,6 +146,8 @@ def bootstrap_ci(sample: np.ndarray,
         tmp = qa1
         qa1 = 2 * est - qa2
         qa2 = 2 * est - tmp
+    if adaptive:
+        return est, (qa1, qa2), len(bs_estimates)
     return est, (qa1, qa2)
 
 
@@ -26,3 +157,17 @@ def compute_ecdf_ci_bands(sample: np.ndarray, alpha, k=1, **kwargs):
     cdf, sample = ecdf(sample, **kwargs)
     cdf = cdf ** k
     return (np.clip(cdf - eps, 0, 1), np.clip(cdf + eps, 0, 1)), sample
+
+
+def wilson_interval(successes, trials, alpha=0.05):
+    z = norm.ppf(1 - alpha / 2)
+    trials = np.maximum(trials, 1)
+    p = successes / trials
+    center = (p + z ** 2 / (2 * trials)) / (1 + z ** 2 / trials)
+    width = z * np.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / (1 + z ** 2 / trials)
+    return center - width, center + width
+
+
+def normal_interval(est, var, alpha=0.05):
+    z = norm.ppf(1 - alpha / 2)
+    return est - z * np.sqrt(var), est + z * np.sqrt(var)
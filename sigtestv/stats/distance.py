@@ -27,29 +27,70 @@ def iter_ecdf_distances(ecdf1: np.ndarray,
             s1_idx += 1
 
 
+def evaluate_ecdf(ecdf: np.ndarray, sample: np.ndarray, points: np.ndarray):
+    idx = np.searchsorted(sample, points, side='right') - 1
+    return np.where(idx >= 0, ecdf[np.maximum(idx, 0)], 0)
+
+
+def merge_ecdfs(ecdf1: np.ndarray,
+                sample1: np.ndarray,
+                ecdf2: np.ndarray,
+                sample2: np.ndarray):
+    grid = np.union1d(sample1, sample2)
+    return grid, evaluate_ecdf(ecdf1, sample1, grid), evaluate_ecdf(ecdf2, sample2, grid)
+
+
+def merge_ecdfs_batch(ecdf1: np.ndarray,
+                      sample1: np.ndarray,
+                      ecdf2: np.ndarray,
+                      sample2: np.ndarray):
+    # Rows are merged with one stable argsort; since CDFs are nondecreasing, a running maximum carries each step
+    # function forward from its last support point. Only the last position of a run of tied grid values is valid
+    ecdf1, sample1, ecdf2, sample2 = map(np.atleast_2d, (ecdf1, sample1, ecdf2, sample2))
+    n = sample1.shape[-1]
+    m = sample2.shape[-1]
+    rows = max(len(sample1), len(sample2))
+    z = np.concatenate((np.broadcast_to(sample1, (rows, n)), np.broadcast_to(sample2, (rows, m))), -1)
+    values = np.concatenate((np.broadcast_to(ecdf1, (rows, n)), np.broadcast_to(ecdf2, (rows, m))), -1)
+    order = np.argsort(z, -1, kind='stable')
+    grid = np.take_along_axis(z, order, -1)
+    values = np.take_along_axis(values, order, -1)
+    from1 = order < n
+    cdf1 = np.maximum.accumulate(np.where(from1, values, 0), -1)
+    cdf2 = np.maximum.accumulate(np.where(from1, 0, values), -1)
+    valid = np.ones(grid.shape, dtype=bool)
+    valid[..., :-1] = grid[..., 1:] != grid[..., :-1]
+    return grid, cdf1, cdf2, valid
+
+
 def compute_ks_distance(ecdf1: np.ndarray,
                         sample1: np.ndarray,
                         ecdf2: np.ndarray,
                         sample2: np.ndarray):
-    max_dist = 0
-    max_val = 0
-    for dist, val, _, _, _ in iter_ecdf_distances(ecdf1, sample1, ecdf2, sample2):
-        if dist > max_dist:
-            max_dist = dist
-            max_val = val
-    return max_val, max_dist
+    grid, cdf1, cdf2 = merge_ecdfs(ecdf1, sample1, ecdf2, sample2)
+    dists = np.abs(cdf1 - cdf2)
+    idx = np.argmax(dists)
+    return grid[idx], dists[idx]
+
+
+def compute_ks_distance_batch(ecdf1: np.ndarray,
+                              sample1: np.ndarray,
+                              ecdf2: np.ndarray,
+                              sample2: np.ndarray):
+    grid, cdf1, cdf2, valid = merge_ecdfs_batch(ecdf1, sample1, ecdf2, sample2)
+    dists = np.abs(cdf1 - cdf2) * valid
+    idx = np.argmax(dists, -1)[:, None]
+    return np.take_along_axis(grid, idx, -1)[:, 0], np.take_along_axis(dists, idx, -1)[:, 0]
 
 
 def maximum_pointwise_cdf_error(x0, y0):
-    if x0 < y0:
-        y = x0
-        x0 = y0
-        y0 = y
-    if x0 == 1 and x0 > y0:
-        return 1
-    k = np.log(np.log(y0) / np.log(x0))
-    k = k / np.log(x0 / y0)
-    return x0 ** k - y0 ** k
+    # max_k x0 ** k - y0 ** k for x0 >= y0; the supremum is 1 when x0 == 1 or y0 == 0 and 0 when x0 == y0
+    x0, y0 = np.maximum(x0, y0), np.minimum(x0, y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.log(np.log(y0) / np.log(x0))
+        k = k / np.log(x0 / y0)
+        error = x0 ** k - y0 ** k
+    return np.where(x0 == y0, 0., np.where((x0 == 1) | (y0 == 0), 1., error))[()]
 
 
 def compute_mme_bias(cdf: np.ndarray,
@@ -63,4 +104,18 @@ def maximum_cdf_error(ecdf1: np.ndarray,
                       sample1: np.ndarray,
                       ecdf2: np.ndarray,
                       sample2: np.ndarray):
-    return max(maximum_pointwise_cdf_error(x0, y0) for _, _, _, x0, y0 in iter_ecdf_distances(ecdf1, sample1, ecdf2, sample2))
+    # Like the stepwise walk this replaced, skip the last grid point, where both CDFs reach 1, and points where the
+    # smaller CDF is still 0; the supremum at those points is trivially 1
+    _, cdf1, cdf2 = merge_ecdfs(ecdf1, sample1, ecdf2, sample2)
+    valid = np.minimum(cdf1, cdf2)[:-1] > 0
+    return np.max(maximum_pointwise_cdf_error(cdf1[:-1], cdf2[:-1]) * valid, initial=0)
+
+
+def maximum_cdf_error_batch(ecdf1: np.ndarray,
+                            sample1: np.ndarray,
+                            ecdf2: np.ndarray,
+                            sample2: np.ndarray):
+    _, cdf1, cdf2, valid = merge_ecdfs_batch(ecdf1, sample1, ecdf2, sample2)
+    valid = valid[..., :-1] & (np.minimum(cdf1, cdf2)[..., :-1] > 0)
+    errors = maximum_pointwise_cdf_error(cdf1[..., :-1], cdf2[..., :-1])
+    return np.max(np.where(valid, errors, 0), -1, initial=0)
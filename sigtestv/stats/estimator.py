@@ -6,7 +6,10 @@ from scipy.stats import beta
 from scipy.special import betainc
 import numpy as np
 
-from .ci import bootstrap_ci
+from .ci import bootstrap_ci, normal_interval
+from .sample import HistogramSample, SortedSample, as_sorted_sample
+from .utils import as_generator
+from sigtestv.utils import array_cache, get_disk_cache
 
 
 @dataclass(frozen=True)
@@ -23,15 +26,30 @@ class Estimator(object):
     def __eq__(self, other):
         return self.name == other.name
 
+    def get_rng(self, rng=None):
+        return as_generator(self.options.get('rng') if rng is None else rng)
+
     def estimate_point(self, sample: np.ndarray):
         raise NotImplementedError
 
-    def estimate_interval(self, sample: np.ndarray, alpha=0.05):
+    def estimate_interval(self, sample: np.ndarray, alpha=0.05, rng=None):
         return bootstrap_ci(sample,
                             self.estimate_point,
                             alpha=alpha,
                             method='percentile-bootstrap',
-                            ci_samples=2000)
+                            ci_samples=2000,
+                            batch_estimate_fn=getattr(self, 'estimate_point_batch', None),
+                            rng=self.get_rng(rng),
+                            **self.resampling_kwargs())
+
+    def resampling_kwargs(self):
+        return dict(resampling=self.options.get('ci_resampling', 'multinomial'),
+                    weighted_estimate_fn=getattr(self, 'estimate_point_weighted', None))
+
+    def estimate_curve(self, sample: np.ndarray, ns=None):
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        return np.array([type(self)(dict(self.options, n=n)).estimate_point(sample) for n in ns])
 
     @classmethod
     def gen_class(cls, default_options: Dict[str, Any] = None):
@@ -63,27 +81,96 @@ def beta_cdf_linspace(a, b, n, pow=1):
     return cdfs[1:] - cdfs[:-1]
 
 
-@lru_cache(maxsize=1000)
-def beta_cdf_shifted(a, b, n, pow=1):
-    deltaU = np.array([betainc(a, b, (i / n) ** pow) for i in range(1, n + 1)])
-    deltaL = np.array([betainc(a, b, (i / n) ** pow) for i in range(0, n)])
-    delta = deltaU - deltaL
-    return delta
-
-
-def harrelldavis_estimate(sample, q, pow=1):
-    n = len(sample)
-    a = (n + 1) * q
-    b = (n + 1) * (1 - q)
-    # delta = beta_cdf_linspace(a, b, n, pow=pow)
-    sample = np.sort(sample)
-    delta = beta_cdf_shifted(a, b, n, pow=pow)
-    return np.sum(delta * sample)
+def harrelldavis_weight_matrix(n, qs, pows=1):
+    qs, pows = np.broadcast_arrays(np.asarray(qs, dtype=float), np.asarray(pows, dtype=float))
+    a = (n + 1) * qs[..., None]
+    b = (n + 1) * (1 - qs[..., None])
+    return np.diff(betainc(a, b, (np.arange(n + 1) / n) ** pows[..., None]), axis=-1)
 
 
 @lru_cache(maxsize=1000)
-def sorted_cache(a):
-    return np.sort(a.x)
+def harrelldavis_weights(n, q, pow=1):
+    cache = get_disk_cache('harrelldavis')
+    key = (n, float(q), float(pow))
+    weights = None if cache is None else cache.get(key)
+    if weights is None:
+        weights = harrelldavis_weight_matrix(n, q, pow)
+        if cache is not None:
+            cache.put(key, weights)
+    weights.setflags(write=False)
+    return weights
+
+
+def harrelldavis_estimate(sample, q, pow=1, sorted=False):
+    if isinstance(sample, HistogramSample):
+        return harrelldavis_estimate_weighted(sample.unique, sample.counts, q, pow=pow)
+    if isinstance(sample, SortedSample):
+        sample, sorted = sample.sorted, True
+    if not sorted:
+        sample = np.sort(sample)
+    return harrelldavis_weights(len(sample), q, pow) @ sample
+
+
+def harrelldavis_estimate_batch(samples, q, pow=1, sorted=False):
+    if not sorted:
+        samples = np.sort(samples, -1)
+    return samples @ harrelldavis_weights(samples.shape[-1], q, pow)
+
+
+def harrelldavis_estimate_weighted(sorted_sample, weights, q, pow=1):
+    # Harrell-Davis on the multiset repeating each element by its weight, with one weight vector per row
+    cum_weights = np.cumsum(weights, -1)
+    total = cum_weights[..., -1:]
+    cdf = betainc((total + 1) * q, (total + 1) * (1 - q), (cum_weights / total) ** pow)
+    return np.sum(np.diff(cdf, prepend=0, axis=-1) * sorted_sample, -1)
+
+
+def quantile_weighted(sorted_sample, weights, q, interpolation='linear'):
+    # np.quantile on the multiset repeating each element by its weight; its j-th order statistic is the first
+    # element whose cumulative weight exceeds j
+    cum_weights = np.cumsum(weights, -1)
+    h = (cum_weights[..., -1] - 1) * q
+    order_statistic = lambda j: sorted_sample[np.sum(cum_weights <= np.asarray(j)[..., None], -1)]
+    if interpolation == 'nearest':
+        return order_statistic(np.around(h))
+    lo = np.floor(h)
+    return order_statistic(lo) + (h - lo) * (order_statistic(np.ceil(h)) - order_statistic(lo))
+
+
+def harrelldavis_curve(sample, q, pows, sorted=False):
+    if not sorted:
+        sample = np.sort(sample)
+    return harrelldavis_weight_matrix(len(sample), q, pows) @ sample
+
+
+def harrelldavis_density(n, q, pow=1):
+    # Density of the Harrell-Davis weight function at the spacings F = i / n, i = 1, ..., n - 1
+    u = np.arange(1, n) / n
+    return beta.pdf(u ** pow, (n + 1) * q, (n + 1) * (1 - q)) * pow * u ** (pow - 1)
+
+
+def lstat_analytic_variance(sorted_sample: np.ndarray, density: np.ndarray):
+    # Plug-in variance of the influence function of an L-statistic, with the weight density given on the spacings
+    n = len(sorted_sample)
+    spacings = np.diff(sorted_sample) * density
+    tail = np.cumsum(spacings[::-1])[::-1]
+    influence = np.append(tail, 0) - np.sum(spacings * np.arange(1, n) / n)
+    return np.mean(influence ** 2) / n
+
+
+def lstat_jackknife_variance(sorted_sample: np.ndarray, loo_weights: np.ndarray):
+    # Dropping the j-th order statistic shifts every later one down a weight, so all leave-one-out estimates
+    # are a prefix sum plus a suffix sum
+    n = len(sorted_sample)
+    prefix = np.concatenate(([0], np.cumsum(loo_weights * sorted_sample[:-1])))
+    suffix = np.concatenate((np.cumsum((loo_weights * sorted_sample[1:])[::-1])[::-1], [0]))
+    loo_estimates = prefix + suffix
+    return (n - 1) / n * np.sum((loo_estimates - loo_estimates.mean()) ** 2)
+
+
+@array_cache
+def sorted_cache(a: np.ndarray):
+    return np.sort(a)
 
 
 @dataclass(frozen=True)
@@ -107,14 +194,44 @@ class QuantileEstimator(Estimator):
 
     def estimate_point(self, sample: np.ndarray):
         q = self.options['quantile']
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
         if self.options['estimate_method'] == 'harrelldavis':
-            return harrelldavis_estimate(sample, q, discrete=self.options['discrete'])
+            return harrelldavis_estimate(sample, q)
         elif self.options['estimate_method'] == 'direct':
-            return np.quantile(sample, q)
+            return np.quantile(sample.sorted, q)
 
-    def estimate_interval(self, sample, alpha=0.05):
+    def estimate_point_batch(self, samples: np.ndarray):
+        q = self.options['quantile']
+        if self.options['estimate_method'] == 'harrelldavis':
+            return harrelldavis_estimate_batch(samples, q)
+        elif self.options['estimate_method'] == 'direct':
+            return np.quantile(samples, q, axis=-1)
+
+    def estimate_point_weighted(self, sorted_sample: np.ndarray, weights: np.ndarray):
+        q = self.options['quantile']
+        if self.options['estimate_method'] == 'harrelldavis':
+            return harrelldavis_estimate_weighted(sorted_sample, weights, q)
+        elif self.options['estimate_method'] == 'direct':
+            return quantile_weighted(sorted_sample, weights, q)
+
+    def estimate_interval(self, sample, alpha=0.05, rng=None):
+        ci_method = self.options['ci_method']
+        if ci_method in ('analytic', 'jackknife'):
+            if self.options['estimate_method'] != 'harrelldavis':
+                raise ValueError(f'The {ci_method} interval is only derived for the Harrell-Davis estimator')
+            q = self.options['quantile']
+            sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+            est = self.estimate_point(sample)
+            if ci_method == 'analytic':
+                var = lstat_analytic_variance(sample.sorted, harrelldavis_density(len(sample), q))
+            else:
+                var = lstat_jackknife_variance(sample.sorted, harrelldavis_weights(len(sample) - 1, q))
+            return est, normal_interval(est, var, alpha)
         return bootstrap_ci(sample,
                             self.estimate_point,
                             alpha=alpha,
-                            method=self.options['ci_method'],
-                            ci_samples=self.options['ci_samples'])
+                            method=ci_method,
+                            ci_samples=self.options['ci_samples'],
+                            batch_estimate_fn=self.estimate_point_batch,
+                            rng=self.get_rng(rng),
+                            **self.resampling_kwargs())
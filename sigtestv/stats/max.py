@@ -1,22 +1,31 @@
 from dataclasses import dataclass
-from functools import lru_cache
+from functools import lru_cache, partial
 
+from scipy.special import gammaln
 import numpy as np
 
-from .ci import bootstrap_ci, compute_ecdf_ci_bands
-from .estimator import Estimator, harrelldavis_estimate
-from .utils import ecdf, pos_mean_ecdf
+from .ci import bootstrap_ci, compute_ecdf_ci_bands, iter_bootstrap_indices, normal_interval
+from .estimator import Estimator, harrelldavis_estimate, harrelldavis_estimate_batch, harrelldavis_estimate_weighted, \
+    harrelldavis_curve, lstat_analytic_variance, lstat_jackknife_variance, quantile_weighted
+from .sample import HistogramSample, as_sorted_sample
+from .utils import as_generator, pos_mean_ecdf, subsample_indices
 from .var_reduce import cv_adjust
-from sigtestv.utils import id_wrap, WrappedObject
+from sigtestv.utils import array_cache
+
+
+def subsample_max_weights(N, ns):
+    # Pr(max of an ns-subset drawn without replacement is the k-th order statistic) = C(k - 1, ns - 1) / C(N, ns)
+    ns = np.asarray(ns)[..., None]
+    k = np.arange(1, N + 1)
+    with np.errstate(invalid='ignore'):
+        log_w = gammaln(k) - gammaln(ns) - gammaln(np.maximum(k - ns + 1, 1)) \
+                - gammaln(N + 1) + gammaln(ns + 1) + gammaln(N - ns + 1)
+    return np.where(k >= ns, np.exp(log_w), 0)
 
 
 @lru_cache(maxsize=10000)
 def compute_expected_rank(K, n):
-    denom = np.arange(n - K + 1, n + 1)
-    coeffs = np.array([np.arange(k - K + 1, k + 1) / denom for k in range(K - 1, n + 1)])
-    coeffs = np.prod(coeffs, 1)
-    delta = coeffs[1:] - coeffs[:-1]
-    return np.sum(np.arange(K, n + 1) * delta)
+    return np.sum(np.arange(1, n + 1) * subsample_max_weights(n, K))
 
 
 def rankify(arr: np.ndarray):
@@ -25,9 +34,40 @@ def rankify(arr: np.ndarray):
     return ranks
 
 
-@lru_cache(maxsize=1000)
-def cached_rankify(arr: WrappedObject):
-    return rankify(arr.x) # TODO: generalize cached numpy routines, add typing
+@array_cache
+def cached_rankify(arr: np.ndarray):
+    return rankify(arr)
+
+
+def meanmax_weights(N, ns):
+    # MeanMax is an L-statistic: ties collapse to the same value, so weighting order statistics suffices
+    return np.diff((np.arange(N + 1) / N) ** np.asarray(ns)[..., None], axis=-1)
+
+
+def meanmax_density(N, n):
+    u = np.arange(1, N) / N
+    return n * u ** (n - 1)
+
+
+def meanmax_top_order_bootstrap(sorted_sample: np.ndarray, n, ci_samples, tol=1e-12, chunk_size=2 ** 22, rng=None):
+    # Under resampling, the MeanMax weights (j / N)^n - ((j - 1) / N)^n put all but tol of their mass on the top m
+    # order statistics of a replicate. Those are drawn directly from Renyi's representation of uniform order
+    # statistics, U_(N) = V_1^(1/N), U_(N-1) = U_(N) V_2^(1/(N-1)), ..., so a replicate costs O(m) instead of an
+    # O(N log N) resample and sort. Returns None when m is too large for this to pay off
+    N = len(sorted_sample)
+    m = int(np.ceil(N * (1 - tol ** (1 / n))))
+    if m > N // 4:
+        return None
+    rng = as_generator(rng)
+    ranks = np.arange(N, N - m, -1)
+    weights = (ranks / N) ** n - ((ranks - 1) / N) ** n
+    rows = max(1, chunk_size // m)
+    estimates = []
+    for idx in range(0, ci_samples, rows):
+        log_u = -np.cumsum(rng.standard_exponential((min(rows, ci_samples - idx), m)) / ranks, 1)
+        indices = np.minimum((np.exp(log_u) * N).astype(np.intp), N - 1)
+        estimates.append(sorted_sample[indices] @ weights)
+    return np.concatenate(estimates)
 
 
 @dataclass(frozen=True)
@@ -45,31 +85,88 @@ class MeanMaxEstimator(Estimator):
 
     def estimate_point(self, sample: np.ndarray):
         n = self.options.get('n', len(sample))
-        if not self.options.get('sorted'):
-            sample = np.sort(sample)
-        cdf, sample = ecdf(sample)
-        return pos_mean_ecdf(cdf ** n, sample)
-
-    def estimate_interval(self, sample, alpha=0.05):
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        return pos_mean_ecdf(sample.cdf ** n, sample.unique)
+
+    def estimate_point_batch(self, samples: np.ndarray):
+        n = self.options.get('n', samples.shape[-1])
+        return np.sort(samples, -1) @ meanmax_weights(samples.shape[-1], n)
+
+    def estimate_point_weighted(self, sorted_sample: np.ndarray, weights: np.ndarray):
+        # Ties add zero-width steps to the integral, so the cumulative weight per position is the weighted ECDF
+        cum_weights = np.cumsum(weights, -1)
+        n = self.options.get('n', cum_weights[..., -1:])
+        return pos_mean_ecdf((cum_weights / cum_weights[..., -1:]) ** n, sorted_sample)
+
+    def estimate_curve(self, sample: np.ndarray, ns=None):
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        return pos_mean_ecdf(sample.cdf ** np.asarray(ns)[:, None], sample.unique)
+
+    def estimate_curve_interval(self, sample: np.ndarray, ns=None, alpha=0.05, rng=None):
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        ns = np.asarray(ns)
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        est = self.estimate_curve(sample, ns)
+        if self.options['ci_method'] == 'direct':
+            (lecdf, uecdf), sample = compute_ecdf_ci_bands(sample, alpha, k=ns[:, None])
+            return est, (pos_mean_ecdf(uecdf, sample), pos_mean_ecdf(lecdf, sample))
+        weights = meanmax_weights(len(sample), ns).T
+        sample = sample.data
+        curves = []
+        for indices in iter_bootstrap_indices(len(sample),
+                                              self.options['ci_samples'],
+                                              chunk_size=2 ** 22 // len(ns),
+                                              rng=self.get_rng(rng)):
+            curves.append(np.sort(sample[indices], 1) @ weights)
+        qa1, qa2 = np.quantile(np.concatenate(curves), (alpha / 2, 1 - alpha / 2), axis=0)
+        return est, (qa1, qa2)
+
+    def estimate_interval(self, sample, alpha=0.05, rng=None):
         ci_method = self.options['ci_method']
         if ci_method == 'percentile-bootstrap':
+            rng = self.get_rng(rng)
+            sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+            resampling_kwargs = self.resampling_kwargs()
+            if resampling_kwargs['resampling'] == 'multinomial' and not isinstance(sample, HistogramSample):
+                bs_estimates = meanmax_top_order_bootstrap(sample.sorted,
+                                                           self.options.get('n', len(sample)),
+                                                           self.options['ci_samples'],
+                                                           rng=rng)
+                if bs_estimates is not None:
+                    return self.estimate_point(sample), tuple(np.quantile(bs_estimates, (alpha / 2, 1 - alpha / 2)))
             return bootstrap_ci(sample,
                                 self.estimate_point,
                                 alpha=alpha,
                                 method=self.options['ci_method'],
-                                ci_samples=self.options['ci_samples'])
+                                ci_samples=self.options['ci_samples'],
+                                batch_estimate_fn=self.estimate_point_batch,
+                                rng=rng,
+                                **resampling_kwargs)
         elif ci_method == 'direct':
             n = self.options.get('n', len(sample))
+            sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
             est = self.estimate_point(sample)
             (lecdf, uecdf), sample = compute_ecdf_ci_bands(sample, alpha, k=n)
             qa1 = pos_mean_ecdf(uecdf, sample)
             qa2 = pos_mean_ecdf(lecdf, sample)
             return est, (qa1, qa2)
+        elif ci_method in ('analytic', 'jackknife'):
+            n = self.options.get('n', len(sample))
+            sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+            est = self.estimate_point(sample)
+            if ci_method == 'analytic':
+                var = lstat_analytic_variance(sample.sorted, meanmax_density(len(sample), n))
+            else:
+                var = lstat_jackknife_variance(sample.sorted, meanmax_weights(len(sample) - 1, n))
+            return est, normal_interval(est, var, alpha)
 
 
-@lru_cache(maxsize=100000)
-def cached_le_prob(sample: WrappedObject, value):
-    return np.mean(sample.x < value)
+@array_cache
+def cached_le_prob(sample: np.ndarray, value):
+    return np.mean(sample < value)
 
 
 @dataclass(frozen=True)
@@ -93,41 +190,87 @@ class CorrectedMeanMaxEstimator(Estimator):
 
     @property
     def name(self):
-        return f'{"Subsampling " if self.options["method"] == "subsample" else ""}Corrected MeanMax estimator (VR={self.options["vr_methods"]}'\
+        prefix = dict(subsample='Subsampling ', exact='Exact ').get(self.options['method'], '')
+        return f'{prefix}Corrected MeanMax estimator (VR={self.options["vr_methods"]}'\
                f' {self.options["cv_method"]})'
 
-    def estimate_point(self, sample: np.ndarray):
+    def estimate_point(self, sample: np.ndarray, rng=None):
         n = self.options.get('n', len(sample))
-        use_cv = 'cv' in self.options['vr_methods']
-        use_av = 'av' in self.options['vr_methods']
-        cv_rank = self.options['cv_method'] == 'rank'
-        cdf_map = ecdf(sample, sorted=False, equality=False, return_map=True)
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        if self.options['method'] == 'exact':
+            estimate = self.estimate_curve(sample, n)
+            return tuple(x[0] for x in estimate) if self.options['output_prob'] else estimate[0]
         if self.options['method'] == 'mean':
-            chunks = np.array_split(sample, len(sample) // n)
+            if isinstance(sample, HistogramSample):
+                raise ValueError('The mean method needs the sample in its original order')
+            chunks = np.array_split(sample.data, len(sample) // n)
             chunks = [chunk[:n] for chunk in chunks]
             return np.mean([np.max(chunk) for chunk in chunks])
         elif self.options['method'] == 'subsample':
-            n_samples = self.options['samples']
-            samples = np.empty(n_samples)
-            output_prob = self.options['output_prob']
-            if output_prob:
-                probs = np.empty(n_samples)
-            for idx in range(n_samples):
-                samples[idx] = tmax = np.max(np.random.choice(sample, n, replace=False))
-                if output_prob:
-                    probs[idx] = cdf_map[tmax]
-            if output_prob:
-                return np.mean(samples), np.mean(probs)
-            return np.mean(samples)
-
-    def estimate_interval(self, sample, alpha=0.05):
+            estimate, prob, _ = self.estimate_subsample(sample, rng=rng)
+            return (estimate, prob) if self.options['output_prob'] else estimate
+
+    def estimate_subsample(self, sample: np.ndarray, rng=None):
+        # Returns the subsampling estimate, the estimated Pr(X < max) (None without output_prob) and the variance
+        # reduction factor, i.e., the plain Monte Carlo variance per subsample over the achieved one
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        N = len(sample)
+        n = self.options.get('n', N)
+        use_cv = 'cv' in self.options['vr_methods']
+        use_av = 'av' in self.options['vr_methods']
+        if use_cv and self.options['cv_method'] != 'rank':
+            raise ValueError(f'Unknown control variate {self.options["cv_method"]}')
+        rng = self.get_rng(rng)
+        n_draws = self.options['samples'] // 2 if use_av else self.options['samples']
+        indices = subsample_indices(N, n, n_draws, rng=rng)
+        lo = indices.min(1)
+        hi = indices.max(1)
+        # Positions index the sorted sample; the antithetic subsample mirrors every position, so its max is the
+        # mirrored min of the original subsample
+        positions = np.stack((hi, N - 1 - lo), 1) if use_av else hi[:, None]
+        samples = sample.sorted[positions]
+        outputs = [samples]
+        if self.options['output_prob']:
+            outputs.append(np.repeat(sample.cdf_lt, sample.counts)[positions])
+        outputs = [x.mean(1) for x in outputs]
+        if use_cv:
+            control = np.mean(positions + 1, 1)
+            outputs = [cv_adjust(x, control, compute_expected_rank(n, N)) for x in outputs]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vr_factor = (np.var(samples) / samples.size) / (np.var(outputs[0]) / len(outputs[0]))
+        return np.mean(outputs[0]), np.mean(outputs[1]) if self.options['output_prob'] else None, vr_factor
+
+    def estimate_point_batch(self, samples: np.ndarray, rng=None):
+        if self.options['method'] != 'exact' or self.options['output_prob']:
+            rng = self.get_rng(rng)
+            return np.array([self.estimate_point(x, rng=rng) for x in samples])
+        n = self.options.get('n', samples.shape[-1])
+        return np.sort(samples, -1) @ subsample_max_weights(samples.shape[-1], n)
+
+    def estimate_curve(self, sample: np.ndarray, ns=None):
+        if self.options['method'] != 'exact':
+            return super().estimate_curve(sample, ns)
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        weights = subsample_max_weights(len(sample), np.atleast_1d(ns))
+        if self.options['output_prob']:
+            return weights @ sample.sorted, weights @ np.repeat(sample.cdf_lt, sample.counts)
+        return weights @ sample.sorted
+
+    def estimate_interval(self, sample, alpha=0.05, rng=None):
         ci_method = self.options['ci_method']
         if ci_method == 'percentile-bootstrap':
+            rng = self.get_rng(rng)
+            exact = self.options['method'] == 'exact' and not self.options['output_prob']
             return bootstrap_ci(sample,
-                                self.estimate_point,
+                                partial(self.estimate_point, rng=rng),
                                 alpha=alpha,
                                 method=self.options['ci_method'],
-                                ci_samples=self.options['ci_samples'])
+                                ci_samples=self.options['ci_samples'],
+                                batch_estimate_fn=self.estimate_point_batch if exact else None,
+                                rng=rng,
+                                **self.resampling_kwargs())
 
 
 @dataclass(frozen=True)
@@ -150,17 +293,76 @@ class QuantileMaxEstimator(Estimator):
     def estimate_point(self, sample: np.ndarray):
         q = self.options['quantile']
         n = self.options.get('n', len(sample))
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
         if self.options['estimate_method'] == 'harrelldavis':
             return harrelldavis_estimate(sample, q, pow=n)
         if self.options['estimate_method'] == 'direct':
-            return np.quantile(sample, q ** (1 / n), interpolation='nearest')
+            return np.quantile(sample.sorted, q ** (1 / n), method='nearest')
 
-    def estimate_interval(self, sample, alpha=0.05):
+    def estimate_point_batch(self, samples: np.ndarray):
+        q = self.options['quantile']
+        n = self.options.get('n', samples.shape[-1])
+        if self.options['estimate_method'] == 'harrelldavis':
+            return harrelldavis_estimate_batch(samples, q, pow=n)
+        if self.options['estimate_method'] == 'direct':
+            return np.quantile(samples, q ** (1 / n), axis=-1, method='nearest')
+
+    def estimate_point_weighted(self, sorted_sample: np.ndarray, weights: np.ndarray):
+        q = self.options['quantile']
+        n = self.options.get('n', np.sum(weights, -1))
+        if self.options['estimate_method'] == 'harrelldavis':
+            return harrelldavis_estimate_weighted(sorted_sample, weights, q, pow=np.asarray(n)[..., None])
+        if self.options['estimate_method'] == 'direct':
+            return quantile_weighted(sorted_sample, weights, q ** (1 / n), interpolation='nearest')
+
+    def estimate_curve(self, sample: np.ndarray, ns=None):
+        q = self.options['quantile']
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        sample = as_sorted_sample(sample, sorted=self.options.get('sorted', False))
+        if self.options['estimate_method'] == 'harrelldavis':
+            return harrelldavis_curve(sample.sorted, q, ns, sorted=True)
+        if self.options['estimate_method'] == 'direct':
+            return np.quantile(sample.sorted, q ** (1 / np.asarray(ns)), method='nearest')
+
+    def estimate_interval(self, sample, alpha=0.05, rng=None):
+        ci_method = self.options['ci_method']
+        if ci_method in ('analytic', 'jackknife'):
+            # The normal interval under-covers here: the weights q^(1/n) pile onto the top order statistics, so
+            # the estimate is skewed and its variance is badly estimated from one sample (85-89% at alpha=0.05)
+            raise ValueError(f'The {ci_method} interval does not reach its nominal coverage for QuantileMax; '
+                             'use a bootstrap ci_method')
         return bootstrap_ci(sample,
                             self.estimate_point,
                             alpha=alpha,
-                            method=self.options['ci_method'],
-                            ci_samples=self.options['ci_samples'])
+                            method=ci_method,
+                            ci_samples=self.options['ci_samples'],
+                            batch_estimate_fn=self.estimate_point_batch,
+                            rng=self.get_rng(rng),
+                            **self.resampling_kwargs())
+
+
+def search_quantile_max_budget(sorted_sample: np.ndarray, q, threshold, max_n=None, batch_size=16):
+    # The QuantileMax value is nondecreasing in n: bracket the first n reaching the threshold with powers of two,
+    # then narrow the bracket by evaluating batch_size candidates per step
+    if max_n is None:
+        max_n = len(sorted_sample) ** 2
+    candidates = np.unique(np.minimum(2 ** np.arange(int(np.ceil(np.log2(max_n))) + 1), max_n))
+    lo, hi = 1, max_n
+    while True:
+        hits = harrelldavis_curve(sorted_sample, q, candidates, sorted=True) >= threshold
+        if not hits.any():
+            if candidates[-1] == max_n:
+                return max_n
+            lo = candidates[-1] + 1
+        else:
+            first = np.argmax(hits)
+            hi = candidates[first]
+            if first > 0:
+                lo = candidates[first - 1] + 1
+        if lo >= hi:
+            return hi
+        candidates = np.unique(np.linspace(lo, hi - 1, min(batch_size, hi - lo)).astype(int))
 
 
 @dataclass(frozen=True)
@@ -182,32 +384,44 @@ class MeanMaxBudgetEstimator(Estimator):
     def name(self):
         return 'MeanMax Budget Estimator'
 
+    def estimate_curve(self, sample: np.ndarray, ns=None):
+        if self.options['theta_method'] != 'mme':
+            return super().estimate_curve(sample, ns)
+        if ns is None:
+            ns = np.arange(1, len(sample) + 1)
+        alpha = self.options['alpha']
+        sample = as_sorted_sample(sample, sorted=self.options['sorted'])
+        sorted_sample = sample.sorted
+        thetahats = MeanMaxEstimator().estimate_curve(sample, ns)
+        if self.options['method'] == 'forward':
+            num = np.log(1 - alpha)
+            denom = np.log(sample.le_prob(thetahats))
+            return (np.ceil(num / denom) if self.options.get('ceil', True) else num / denom) * self.options['budget']
+        elif self.options['method'] == 'backward':
+            return np.array([search_quantile_max_budget(sorted_sample, 1 - alpha, thetahat) for thetahat in thetahats])
+
     def estimate_point(self, sample: np.ndarray):
         k = self.options.get('n', len(sample))
         alpha = self.options['alpha']
         method = self.options['method']
         theta_method = self.options['theta_method']
         le_prob = None
+        sample = as_sorted_sample(sample, sorted=self.options['sorted'])
         if theta_method == 'mme':
             mme = MeanMaxEstimator(options=dict(n=k))
         else:
-            mme = CorrectedMeanMaxEstimator(options=dict(n=k, output_prob=True))
+            mme = CorrectedMeanMaxEstimator(options=dict(n=k, output_prob=True, rng=self.options.get('rng')))
         try:
             thetahat, le_prob = mme.estimate_point(sample)
         except:
             thetahat = mme.estimate_point(sample)
         if method == 'forward':
             num = np.log(1 - alpha)
-            if le_prob is None: le_prob = np.mean(sample <= thetahat)
+            if le_prob is None: le_prob = sample.le_prob(thetahat)
             denom = np.log(le_prob)
             return (np.ceil(num / denom) if self.options.get('ceil', True) else num / denom) * self.options['budget']
         elif method == 'backward':
-            for idx in range(len(sample) ** 2):
-                qme = QuantileMaxEstimator(options=dict(n=idx + 1, quantile=1 - alpha))
-                x = qme.estimate_point(sample)
-                if x >= thetahat:
-                    break
-            return idx + 1
+            return search_quantile_max_budget(sample.sorted, 1 - alpha, thetahat)
 
 
 ForwardEstimator = MeanMaxBudgetEstimator.gen_class(dict(method='forward'))
@@ -0,0 +1,81 @@
+import numpy as np
+
+from .sample import SortedSample
+from .utils import pos_mean_ecdf
+
+
+class OnlineMeanMax(object):
+    # New runs go to an unsorted buffer in O(1). The next read sorts only the m buffered runs, adds the counts of
+    # values already in the support and inserts the new ones with one np.insert, i.e. O(m log m + m log u + u)
+    # per read instead of an O(u) list insert per new value; the u-element support itself is never re-sorted
+
+    def __init__(self, values=()):
+        self._values = np.empty(0)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._pending_values = []
+        self._pending_counts = []
+        self.total = 0
+        self.update(values)
+
+    def __len__(self):
+        return self.total
+
+    def _flush(self):
+        if not self._pending_values:
+            return
+        pending, inverse = np.unique(self._pending_values, return_inverse=True)
+        pending_counts = np.bincount(inverse, weights=self._pending_counts, minlength=len(pending)).astype(np.int64)
+        idx = np.searchsorted(self._values, pending)
+        known = idx < len(self._values)
+        known[known] = self._values[idx[known]] == pending[known]
+        counts = self._counts.copy()
+        counts[idx[known]] += pending_counts[known]
+        self._values = np.insert(self._values, idx[~known], pending[~known])
+        self._counts = np.insert(counts, idx[~known], pending_counts[~known])
+        self._pending_values = []
+        self._pending_counts = []
+
+    @property
+    def values(self):
+        self._flush()
+        return self._values
+
+    @property
+    def counts(self):
+        self._flush()
+        return self._counts
+
+    def add(self, value, count=1):
+        self._pending_values.append(value)
+        self._pending_counts.append(count)
+        self.total += count
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self._pending_values.extend(values.tolist())
+        self._pending_counts.extend([1] * len(values))
+        self.total += len(values)
+
+    def merge(self, other: 'OnlineMeanMax'):
+        # Shards hold disjoint runs, so the merged state is the union of support points with summed counts
+        merged = OnlineMeanMax()
+        merged._values = self.values
+        merged._counts = self.counts
+        merged._pending_values = other.values.tolist()
+        merged._pending_counts = other.counts.tolist()
+        merged.total = self.total + other.total
+        return merged
+
+    def estimate_point(self, n=None):
+        return self.estimate_curve([self.total if n is None else n])[0]
+
+    def estimate_curve(self, ns=None):
+        if self.total == 0:
+            raise ValueError('OnlineMeanMax has no runs to estimate from')
+        if ns is None:
+            ns = np.arange(1, self.total + 1)
+        cdf = np.cumsum(self.counts) / self.total
+        return pos_mean_ecdf(cdf ** np.asarray(ns)[:, None], self.values)
+
+    def sorted_sample(self):
+        return SortedSample(np.repeat(self.values, self.counts), sorted=True)
@@ -0,0 +1,75 @@
+from scipy.integrate import quad
+import numpy as np
+
+from .simulation import DiscreteSampler
+from .utils import pos_mean_ecdf
+from sigtestv.utils import ArrayMemo, array_digest
+
+
+_memo = ArrayMemo()
+
+
+def as_distribution(dist):
+    # Accept the bound rvs method of a frozen scipy distribution, which is what the simulation scripts pass around
+    dist = getattr(dist, '__self__', dist)
+    if not hasattr(dist, 'cdf'):
+        raise TypeError(f'{type(dist).__name__} is not a distribution with a cdf')
+    return dist
+
+
+def distribution_key(dist):
+    if isinstance(dist, DiscreteSampler):
+        return 'discrete', array_digest(dist.support), array_digest(dist.probs)
+    return dist.dist.name, dist.args, tuple(sorted(dist.kwds.items()))
+
+
+def discrete_expected_max(dist: DiscreteSampler, n):
+    order = np.argsort(dist.support, kind='stable')
+    cdf = np.minimum(np.cumsum(dist.probs[order]), 1)
+    return pos_mean_ecdf(cdf ** n, dist.support[order]), 0.
+
+
+def continuous_expected_max(dist, n, epsabs=1e-10, epsrel=1e-10):
+    # E[max] = c + int_c^hi (1 - F^n) - int_lo^c F^n, split at the median of the maximum so that quad sees its mass
+    lo, hi = dist.support()
+    c = dist.ppf(0.5 ** (1 / n))
+    upper, upper_err = quad(lambda x: -np.expm1(n * dist.logcdf(x)), c, hi, epsabs=epsabs, epsrel=epsrel, limit=200)
+    lower, lower_err = quad(lambda x: np.exp(n * dist.logcdf(x)), lo, c, epsabs=epsabs, epsrel=epsrel, limit=200)
+    return c + upper - lower, upper_err + lower_err
+
+
+def expected_max(dist, n, return_error=False):
+    if n <= 0:
+        raise ValueError('n must be positive')
+    dist = as_distribution(dist)
+    key = distribution_key(dist), float(n)
+    try:
+        value, error = _memo.get(key)
+    except KeyError:
+        fn = discrete_expected_max if isinstance(dist, DiscreteSampler) else continuous_expected_max
+        value, error = fn(dist, n)
+        _memo.put(key, (float(value), float(error)))
+    return (value, error) if return_error else value
+
+
+def expected_max_curve(dist, ns):
+    return np.array([expected_max(dist, n) for n in ns])
+
+
+def population_quantile(dist, q):
+    dist = as_distribution(dist)
+    if isinstance(dist, DiscreteSampler):
+        order = np.argsort(dist.support, kind='stable')
+        idx = np.searchsorted(np.cumsum(dist.probs[order]), q, side='left')
+        return dist.support[order][np.minimum(idx, len(dist) - 1)]
+    return dist.ppf(q)
+
+
+def quantile_max(dist, n, q=0.5):
+    # The q-th quantile of the maximum of n draws is the q^(1/n)-th quantile of one draw
+    return population_quantile(dist, q ** (1 / n))
+
+
+def forward_budget(dist, n, alpha=0.95):
+    dist = as_distribution(dist)
+    return np.log(1 - alpha) / np.log(dist.cdf(expected_max(dist, n)))
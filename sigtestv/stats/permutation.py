@@ -0,0 +1,68 @@
+from itertools import combinations, islice
+from math import comb
+
+import numpy as np
+
+from .ci import wilson_interval
+from .utils import as_generator, ecdf_batch
+
+
+def use_exact_permutations(N, n, exact_limit=None):
+    # Exact enumeration is opt-in: it replaces the Monte Carlo p-value whenever the number of splits is small enough
+    return exact_limit is not None and comb(N, n) <= exact_limit
+
+
+def iter_permutation_masks(N, n, iters=1000, batch_size=250, exact_limit=None, rng=None):
+    if use_exact_permutations(N, n, exact_limit):
+        combos = combinations(range(N), n)
+        while True:
+            indices = np.array(list(islice(combos, batch_size)), dtype=int).reshape(-1, n)
+            if len(indices) == 0:
+                return
+            masks = np.zeros((len(indices), N), dtype=bool)
+            np.put_along_axis(masks, indices, True, 1)
+            yield masks
+    else:
+        rng = as_generator(rng)
+        for idx in range(0, iters, batch_size):
+            yield np.argsort(rng.random((min(batch_size, iters - idx), N)), 1) < n
+
+
+def make_rank_pr_x_ge_y(sorted_pooled: np.ndarray, n):
+    # Pr(X >= Y) only depends on which tie groups the X labels fall in, so each permutation is a masked rank sum
+    upper = ecdf_batch(sorted_pooled, normalize=False)[0] - 1
+    m = len(sorted_pooled) - n
+
+    def statistic(masks: np.ndarray):
+        y_counts = np.cumsum(~masks, 1)
+        return np.sum(masks * y_counts[:, upper], 1) / (n * m)
+    return statistic
+
+
+def permutation_test(sample1: np.ndarray,
+                     sample2: np.ndarray,
+                     statistic_factory=make_rank_pr_x_ge_y,
+                     alpha=0.05,
+                     iters=1000,
+                     batch_size=250,
+                     exact_limit=None,
+                     early_stop=False,
+                     early_stop_alpha=0.01,
+                     rng=None):
+    pooled = np.concatenate((sample1, sample2))
+    N = len(pooled)
+    n = len(sample1)
+    order = np.argsort(pooled, kind='stable')
+    statistic = statistic_factory(pooled[order], n)
+    gt = statistic((order < n)[None])[0]
+    exact = use_exact_permutations(N, n, exact_limit)
+    count = 0
+    total = 0
+    for masks in iter_permutation_masks(N, n, iters=iters, batch_size=batch_size, exact_limit=exact_limit, rng=rng):
+        count += np.sum(statistic(masks) <= gt)
+        total += len(masks)
+        if early_stop and not exact:
+            lower, upper = wilson_interval(count, total, alpha=early_stop_alpha)
+            if upper < alpha or lower > alpha:
+                break
+    return count / total, total
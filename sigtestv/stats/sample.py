@@ -0,0 +1,114 @@
+from functools import cached_property
+
+from scipy.stats import rankdata
+import numpy as np
+
+from sigtestv.utils import array_digest
+
+
+def _readonly(x: np.ndarray):
+    x.setflags(write=False)
+    return x
+
+
+class SortedSample(object):
+
+    def __init__(self, data, sorted=False):
+        object.__setattr__(self, 'data', _readonly(np.array(data)))
+        if sorted:
+            self.__dict__['sorted'] = self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy or dtype is not None:
+            return np.array(self.data, dtype=dtype)
+        return self.data
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    @cached_property
+    def sorted(self):
+        return _readonly(np.sort(self.data))
+
+    @cached_property
+    def group_starts(self):
+        sample = self.sorted
+        return _readonly(np.flatnonzero(np.concatenate(([True], sample[1:] != sample[:-1]))))
+
+    @cached_property
+    def unique(self):
+        return _readonly(self.sorted[self.group_starts])
+
+    @cached_property
+    def counts(self):
+        return _readonly(np.diff(np.append(self.group_starts, len(self))))
+
+    @cached_property
+    def cdf(self):
+        return _readonly(np.cumsum(self.counts) / len(self))
+
+    @cached_property
+    def cdf_lt(self):
+        return _readonly(np.concatenate(([0], self.cdf[:-1])))
+
+    @cached_property
+    def ranks(self):
+        return _readonly(rankdata(self.data))
+
+    @cached_property
+    def digest(self):
+        return array_digest(self.data)
+
+    def le_prob(self, value):
+        return np.searchsorted(self.sorted, value, side='right') / len(self)
+
+
+def as_sorted_sample(sample, sorted=False):
+    if isinstance(sample, SortedSample):
+        return sample
+    return SortedSample(sample, sorted=sorted)
+
+
+class HistogramSample(SortedSample):
+
+    def __init__(self, values, counts):
+        values, inverse = np.unique(values, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(values)).astype(np.int64)
+        self.__dict__['unique'] = _readonly(values[counts > 0])
+        self.__dict__['counts'] = _readonly(counts[counts > 0])
+        self.__dict__['total'] = int(np.sum(counts))
+
+    def __len__(self):
+        return self.total
+
+    @cached_property
+    def data(self):
+        return self.sorted
+
+    @cached_property
+    def sorted(self):
+        return _readonly(np.repeat(self.unique, self.counts))
+
+    @cached_property
+    def group_starts(self):
+        return _readonly(np.concatenate(([0], np.cumsum(self.counts)[:-1])))
+
+    @cached_property
+    def digest(self):
+        return array_digest(self.unique) + array_digest(self.counts)
+
+    def le_prob(self, value):
+        idx = np.searchsorted(self.unique, value, side='right')
+        return np.concatenate(([0], self.cdf))[idx]
+
+
+def as_histogram_sample(sample):
+    if isinstance(sample, HistogramSample):
+        return sample
+    if isinstance(sample, SortedSample):
+        return HistogramSample(sample.unique, sample.counts)
+    values, counts = np.unique(sample, return_counts=True)
+    return HistogramSample(values, counts)
@@ -1,33 +1,94 @@
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
 from functools import partial
 from typing import Sequence, Callable, Tuple
+import zlib
 
-from tqdm import trange
+from tqdm import tqdm
 import numpy as np
 import statsmodels.api as sm
 
+from .ci import wilson_interval
 from .test import TwoSampleHypothesisTest
-from .utils import compute_pr_x_ge_y
+from .utils import as_generator, compute_pr_x_ge_y, subsample_indices
+from sigtestv.utils import array_cache, array_digest, get_disk_cache
 
 
 BinaryOrderingFn = Callable[[np.ndarray, np.ndarray], float]
 
 
-def dfromc_rvs(bins, cdf, **cdf_kwargs):
+def build_alias_table(probs: np.ndarray):
+    # Vose's method: every bin keeps its own mass up to 1 / n and borrows the rest from a single alias bin
+    n = len(probs)
+    scaled = list(probs * n)
+    accept = np.ones(n)
+    alias = np.arange(n)
+    small = [idx for idx, p in enumerate(scaled) if p < 1]
+    large = [idx for idx, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        s_idx = small.pop()
+        l_idx = large.pop()
+        accept[s_idx] = scaled[s_idx]
+        alias[s_idx] = l_idx
+        scaled[l_idx] -= 1 - scaled[s_idx]
+        (small if scaled[l_idx] < 1 else large).append(l_idx)
+    return accept, alias
+
+
+class DiscreteSampler(object):
+
+    def __init__(self, support: np.ndarray, probs: np.ndarray, rng=None):
+        probs = np.asarray(probs, dtype=float)
+        self.support = np.asarray(support)
+        self.probs = probs / probs.sum()
+        self.accept, self.alias = build_alias_table(self.probs)
+        self.rng = None if rng is None else as_generator(rng)
+
+    def __len__(self):
+        return len(self.support)
+
+    def __call__(self, size=None, rng=None):
+        rng = as_generator(self.rng if rng is None else rng)
+        u = np.asarray(rng.random(size)) * len(self)
+        idx = np.minimum(u.astype(np.intp), len(self) - 1)
+        idx = np.where(u - idx < self.accept[idx], idx, self.alias[idx])
+        return self.support[idx]
+
+    def rvs(self, size=None, rng=None):
+        return self(size=size, rng=rng)
+
+    def cdf(self, x):
+        order = np.argsort(self.support, kind='stable')
+        cdf = np.concatenate(([0], np.minimum(np.cumsum(self.probs[order]), 1)))
+        return cdf[np.searchsorted(self.support[order], x, side='right')]
+
+
+def dfromc_rvs(bins, cdf, rng=None, **cdf_kwargs):
     xs = np.linspace(0, 1, bins + 1)
     cdf_gen = partial(cdf, **cdf_kwargs)
     probs = cdf_gen(xs[1:]) - cdf_gen(xs[:-1])
-    probs = probs / probs.sum()
-    return partial(np.random.choice, np.linspace(0, 1, bins), p=probs)
+    return DiscreteSampler(np.linspace(0, 1, bins), probs, rng=rng)
+
 
+@array_cache
+def kde_pmf(sample: np.ndarray):
+    cache = get_disk_cache('kde')
+    key = array_digest(sample)
+    support_pmf = None if cache is None else cache.get(key)
+    if support_pmf is None:
+        kde = sm.nonparametric.KDEUnivariate(sample)
+        kde.fit()
+        support_pmf = np.stack((kde.support[:-1], kde.cdf[1:] - kde.cdf[:-1]))
+        if cache is not None:
+            cache.put(key, support_pmf)
+    return support_pmf
 
-def dkde_from_sample_rvs(sample: np.ndarray):
-    kde = sm.nonparametric.KDEUnivariate(sample)
-    kde.fit()
-    pmf = kde.cdf[1:] - kde.cdf[:-1]
-    pmf = pmf / pmf.sum()
-    return partial(np.random.choice, kde.support[:-1], p=pmf)
+
+def dkde_from_sample_rvs(sample: np.ndarray, rng=None):
+    support, pmf = kde_pmf(np.asarray(sample, dtype=float))
+    return DiscreteSampler(support, pmf, rng=rng)
 
 
 def order_stochastic(d1, d2):
@@ -38,6 +99,134 @@ def order_quantile(d1, d2, quantile=0.5):
     return np.quantile(d1, quantile) - np.quantile(d2, quantile)
 
 
+def block_test_rng(seed_seq: np.random.SeedSequence, test: TwoSampleHypothesisTest):
+    # Each test draws from its own child stream of the block, so its results do not depend on which other tests are
+    # still running
+    key = zlib.crc32(test.name.encode())
+    return np.random.default_rng(np.random.SeedSequence(seed_seq.entropy, spawn_key=(*seed_seq.spawn_key, key)))
+
+
+def _simulate_power_blocks(blocks, tests, pop_small, pop_big, n1, n2, alpha):
+    counter = Counter()
+    for seed_seq, iters in blocks:
+        rng = np.random.default_rng(seed_seq)
+        xs = pop_small[subsample_indices(len(pop_small), n1, iters, rng=rng)]
+        ys = pop_big[subsample_indices(len(pop_big), n2, iters, rng=rng)]
+        for test in tests:
+            test_rng = block_test_rng(seed_seq, test)
+            for sx, sy in zip(xs, ys):
+                reject, stat, p = test.test(sx, sy, alpha=alpha, rng=test_rng)
+                counter[test.name] += int(reject)
+    return counter
+
+
+def _simulate_type1_blocks(blocks, tests, pop, n, alpha):
+    counter = Counter()
+    for seed_seq, iters in blocks:
+        # Every test draws its own pairs of subsamples
+        for test in tests:
+            rng = block_test_rng(seed_seq, test)
+            sx1s = pop[subsample_indices(len(pop), n, iters, rng=rng)]
+            sx2s = pop[subsample_indices(len(pop), n, iters, rng=rng)]
+            for sx1, sx2 in zip(sx1s, sx2s):
+                reject, stat, p = test.test(sx1, sx2, alpha=alpha, rng=rng)
+                counter[test.name] += int(reject)
+    return counter
+
+
+def simulation_converged(rejections, iters, width=0.02, threshold=None, alpha=0.01):
+    lower, upper = wilson_interval(rejections, iters, alpha=alpha)
+    if threshold is not None and (upper < threshold or lower > threshold):
+        return True
+    return upper - lower < width
+
+
+_worker_blocks_fn = None
+
+
+def _init_block_worker(blocks_fn):
+    # Ships the populations to every worker once instead of pickling them with each block
+    global _worker_blocks_fn
+    _worker_blocks_fn = blocks_fn
+
+
+def _run_block_worker(blocks, tests):
+    return _worker_blocks_fn(blocks, tests)
+
+
+class SimulationResult(dict):
+    # Maps test names to rejection rates; test_iters holds the iterations each test ran, which only differ from the
+    # requested count under early stopping
+
+    def __init__(self, rates, test_iters):
+        super().__init__(rates)
+        self.test_iters = dict(test_iters)
+
+
+def run_simulation_blocks(blocks_fn,
+                          iters,
+                          tests,
+                          seed=None,
+                          workers=1,
+                          block_size=50,
+                          use_tqdm=False,
+                          early_stop=False,
+                          early_stop_width=0.02,
+                          early_stop_threshold=None,
+                          early_stop_alpha=0.01):
+    # Every block of iterations owns a child stream and blocks are tallied in order, so results only depend on the
+    # seed and not on the worker count. Up to two blocks per worker stay in flight; with early stopping, the stopping
+    # rule is checked after every tallied block, and a test that has stopped is ignored in the later blocks
+    num_blocks = int(np.ceil(iters / block_size))
+    if seed is None:
+        # As in as_generator, np.random.seed still makes unseeded simulations reproducible
+        seed = np.random.randint(2 ** 32, dtype=np.uint64)
+    seeds = np.random.SeedSequence(seed).spawn(num_blocks)
+    blocks = iter([(seed_seq, min(block_size, iters - idx * block_size)) for idx, seed_seq in enumerate(seeds)])
+    counter = Counter()
+    test_iters = Counter()
+    active_tests = list(tests)
+    in_flight = deque()
+    executor = ProcessPoolExecutor(workers, initializer=_init_block_worker, initargs=(blocks_fn,)) if workers > 1 \
+        else nullcontext()
+    with tqdm(total=iters, disable=not use_tqdm) as pbar, executor:
+        while True:
+            while active_tests and len(in_flight) < 2 * workers:
+                block = next(blocks, None)
+                if block is None:
+                    break
+                if workers > 1:
+                    in_flight.append((block, executor.submit(_run_block_worker, [block], list(active_tests))))
+                else:
+                    in_flight.append((block, partial(blocks_fn, [block], list(active_tests))))
+            if not in_flight:
+                break
+            (_, size), task = in_flight.popleft()
+            result = task.result() if workers > 1 else task()
+            for test in active_tests:
+                counter[test.name] += result[test.name]
+                test_iters[test.name] += size
+            pbar.update(size)
+            if early_stop:
+                active_tests = [test for test in active_tests if not simulation_converged(counter[test.name],
+                                                                                         test_iters[test.name],
+                                                                                         width=early_stop_width,
+                                                                                         threshold=early_stop_threshold,
+                                                                                         alpha=early_stop_alpha)]
+                if not active_tests:
+                    break
+        for _, task in in_flight:
+            if workers > 1:
+                task.cancel()
+    return counter, test_iters
+
+
+def simulation_kwargs(kwargs):
+    names = ('seed', 'workers', 'block_size', 'early_stop', 'early_stop_width', 'early_stop_threshold',
+             'early_stop_alpha')
+    return {k: kwargs[k] for k in names if k in kwargs}
+
+
 @dataclass
 class ResultPopulationPair(object):
     pop_x: np.ndarray
@@ -57,15 +246,14 @@ class ResultPopulationPair(object):
         alpha = kwargs.get('alpha', 0.05)
         n2 = kwargs.get('n2', n1)
 
-        counter = Counter()
-        for _ in trange(iters, disable=not use_tqdm):
-            sx = np.random.choice(pop_small, n1, replace=False)
-            sy = np.random.choice(pop_big, n2, replace=False)
-
-            for test in tests:
-                reject, stat, p = test.test(sx, sy, alpha=alpha)
-                counter[test.name] += int(reject)
-        return {k: v / iters for k, v in counter.items()}
+        blocks_fn = partial(_simulate_power_blocks,
+                            pop_small=np.asarray(pop_small),
+                            pop_big=np.asarray(pop_big),
+                            n1=n1,
+                            n2=n2,
+                            alpha=alpha)
+        counter, test_iters = run_simulation_blocks(blocks_fn, iters, tests, use_tqdm=use_tqdm, **simulation_kwargs(kwargs))
+        return SimulationResult({k: counter[k] / v for k, v in test_iters.items()}, test_iters)
 
 
 @dataclass
@@ -76,11 +264,6 @@ class ResultPopulationSingle(object):
         iters = kwargs.get('iters', 500)
         alpha = kwargs.get('alpha', 0.05)
 
-        counter = Counter()
-        for _ in trange(iters, disable=not use_tqdm):
-            for test in tests:
-                sx1 = np.random.choice(self.pop, n, replace=False)
-                sx2 = np.random.choice(self.pop, n, replace=False)
-                reject, stat, p = test.test(sx1, sx2, alpha=alpha)
-                counter[test.name] += int(reject)
-        return {k: v / iters for k, v in counter.items()}
+        blocks_fn = partial(_simulate_type1_blocks, pop=np.asarray(self.pop), n=n, alpha=alpha)
+        counter, test_iters = run_simulation_blocks(blocks_fn, iters, tests, use_tqdm=use_tqdm, **simulation_kwargs(kwargs))
+        return SimulationResult({k: counter[k] / v for k, v in test_iters.items()}, test_iters)
@@ -1,3 +1,10 @@
+from functools import lru_cache
+
+import numpy as np
+
+from sigtestv.utils import get_disk_cache
+
+
 MANN_WHITNEY_UP010 = [[],
                       [0,0,0,0,0,0,0,1,1,1,1,2,2,2,3,3,3,4,4,4],
                       [0,0,0,0,1,2,2,3,3,4,5,5,6,7,7,8,9,9,10,11],
@@ -18,3 +25,32 @@ MANN_WHITNEY_UP010 = [[],
                       [0,],
                       [0,],
                       [0,4,11,18,25,32,39,47,54,62,69,77,84,92,100,107,115,123,130,138]]
+
+
+@lru_cache(maxsize=None)
+def mann_whitney_u_cdf(n, m):
+    # The null distribution of U is symmetric in (n, m)
+    if n > m:
+        return mann_whitney_u_cdf(m, n)
+    cache = get_disk_cache('mannwhitney')
+    cdf = None if cache is None else cache.get((n, m))
+    if cdf is None:
+        cdf = np.cumsum(mann_whitney_u_pmf(n, m))
+        if cache is not None:
+            cache.put((n, m), cdf)
+    cdf.setflags(write=False)
+    return cdf
+
+
+def mann_whitney_u_pmf(n, m):
+    # p(i, j, u) = i / (i + j) * p(i - 1, j, u - j) + j / (i + j) * p(i, j - 1, u), where U counts pairs x > y
+    row = [np.ones(1) for _ in range(m + 1)]
+    for i in range(1, n + 1):
+        new_row = [np.ones(1)]
+        for j in range(1, m + 1):
+            pmf = np.zeros(i * j + 1)
+            pmf[j:j + len(row[j])] += i / (i + j) * row[j]
+            pmf[:len(new_row[j - 1])] += j / (i + j) * new_row[j - 1]
+            new_row.append(pmf)
+        row = new_row
+    return row[m]
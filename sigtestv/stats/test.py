@@ -5,8 +5,9 @@ from scipy import stats
 import numpy as np
 
 from .estimator import QuantileEstimator
-from .utils import compute_pr_x_ge_y
-from .tables import MANN_WHITNEY_UP010
+from .permutation import permutation_test
+from .utils import as_generator, compute_pr_x_ge_y, compute_pr_x_ge_y_batch
+from .tables import mann_whitney_u_cdf
 
 
 @dataclass(frozen=True)
@@ -23,7 +24,14 @@ class TwoSampleHypothesisTest(object):
     def __eq__(self, other):
         return self.name == other.name
 
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
+    def get_rng(self, rng=None):
+        return as_generator(self.options.get('rng') if rng is None else rng)
+
+    def scipy_kwargs(self):
+        # Options forwarded to scipy.stats, which knows nothing about the generator option
+        return {k: v for k, v in self.options.items() if k != 'rng'}
+
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
         raise NotImplementedError
 
 
@@ -37,8 +45,8 @@ class StudentsTTest(TwoSampleHypothesisTest):
         else:
             return 't-test'
 
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
-        t, p = stats.ttest_ind(sample1, sample2, **self.options)
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
+        t, p = stats.ttest_ind(np.asarray(sample1), np.asarray(sample2), **self.scipy_kwargs())
         return p / 2 < alpha and t < 0, t, p
 
 
@@ -49,18 +57,15 @@ class SDBootstrapTest(TwoSampleHypothesisTest):
     def name(self):
         return 'Stochastic Dominance Bootstrap'
 
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
-        iters = self.options.get('iters', 1000)
-        gt = compute_pr_x_ge_y(sample1, sample2)
-        sample = np.concatenate((sample1, sample2))
-        n = len(sample1)
-        stats = []
-        for _ in range(iters):
-            np.random.shuffle(sample)
-            sample1 = sample[:n]
-            sample2 = sample[n:]
-            stats.append(compute_pr_x_ge_y(sample1, sample2))
-        p = np.mean(np.array(stats) <= gt)
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
+        p, _ = permutation_test(np.asarray(sample1),
+                                np.asarray(sample2),
+                                alpha=alpha,
+                                iters=self.options.get('iters', 1000),
+                                batch_size=self.options.get('batch_size', 250),
+                                exact_limit=self.options.get('exact_limit'),
+                                early_stop=self.options.get('early_stop', False),
+                                rng=self.get_rng(rng))
         return p < alpha, p, p
 
 
@@ -76,41 +81,32 @@ class MannWhitneyUTest(TwoSampleHypothesisTest):
             self.options['alternative'] = 'less'
 
     def exact_test(self, s1, s2):
-        s1 = [(x, 0) for x in s1]
-        s2 = [(x, 1) for x in s2]
         n = len(s1)
         m = len(s2)
-        s = sorted(s1 + s2)
-        ranksum1 = 0
-        ranksum2 = 0
-        tmp_ranksum = 0
-        n_ranksum = 0
-        counts = [0, 0]
-        last_x = -1000000
-        for rank, (x, l) in enumerate(s):
-            if x != last_x and n_ranksum > 0:
-                ranksum1 += (tmp_ranksum / n_ranksum) * counts[0]
-                ranksum2 += (tmp_ranksum / n_ranksum) * counts[1]
-                tmp_ranksum = 0
-                n_ranksum = 0
-                counts = [0, 0]
-            counts[l] += 1
-            tmp_ranksum += rank + 1
-            n_ranksum += 1
-            last_x = x
-        if n_ranksum > 0:
-            ranksum1 += (tmp_ranksum / n_ranksum) * counts[0]
-            ranksum2 += (tmp_ranksum / n_ranksum) * counts[1]
+        ranks = stats.rankdata(np.concatenate((s1, s2)))
+        ranksum1 = np.sum(ranks[:n])
+        ranksum2 = np.sum(ranks[n:])
         U1 = (n * m) + (n * (n + 1)) / 2 - ranksum1
         U2 = (n * m) + (m * (m + 1)) / 2 - ranksum2
         U = min(U1, U2)
-        return U, 0.05 if U <= MANN_WHITNEY_UP010[n - 1][m - 1] and ranksum1 < ranksum2 else 0.051
-
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
+        cdf = mann_whitney_u_cdf(n, m)
+        p_less = cdf[int(np.floor(U2))]
+        p_greater = cdf[int(np.floor(U1))]
+        if self.options['alternative'] == 'less':
+            p = p_less
+        elif self.options['alternative'] == 'greater':
+            p = p_greater
+        else: # two-sided
+            p = min(1, 2 * min(p_less, p_greater))
+        return U, p
+
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
+        sample1 = np.asarray(sample1)
+        sample2 = np.asarray(sample2)
         if len(sample1) <= 20 or len(sample2) <= 20:
             U, p = self.exact_test(sample1, sample2)
         else:
-            U, p = stats.mannwhitneyu(sample1, sample2, **self.options)
+            U, p = stats.mannwhitneyu(sample1, sample2, **self.scipy_kwargs())
         return p <= alpha, U, p
 
 
@@ -134,16 +130,16 @@ class QuantileTest(TwoSampleHypothesisTest):
         if self.options['estimate_method'] == 'direct':
             return 'Direct quantile test'
 
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
         test = QuantileEstimator(dict(estimate_method=self.options['estimate_method'],
                                       quantile=self.options['quantile']))
-        dstar_arr = []
         b = self.options['bootstrap_samples']
-        for _ in range(b):
-            sx = test.estimate_point(np.random.choice(sample1, len(sample1)))
-            sy = test.estimate_point(np.random.choice(sample2, len(sample2)))
-            dstar_arr.append(sx - sy)
-        dstar_arr = np.array(dstar_arr)
+        rng = self.get_rng(rng)
+        sample1 = np.asarray(sample1)
+        sample2 = np.asarray(sample2)
+        sx = test.estimate_point_batch(sample1[rng.integers(0, len(sample1), (b, len(sample1)))])
+        sy = test.estimate_point_batch(sample2[rng.integers(0, len(sample2), (b, len(sample2)))])
+        dstar_arr = sx - sy
         pstar = (sum(dstar_arr < 0) + 0.5 * sum(dstar_arr == 0)) / b
         if self.options['alternative'] == 'less':
             p = 1 - pstar
@@ -161,20 +157,18 @@ class ASDTest(TwoSampleHypothesisTest):
     def name(self):
         return 'Almost Stochastic Dominance test'
 
-    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05):
-        tmp = sample2
-        sample2 = sample1
+    def test(self, sample1: np.ndarray, sample2: np.ndarray, alpha=0.05, rng=None):
+        tmp = np.asarray(sample2)
+        sample2 = np.asarray(sample1)
         sample1 = tmp
         phi = stats.norm.ppf(alpha)
-        epsilons = []
         n = len(sample1)
         m = len(sample2)
         c = np.sqrt(n * m / (n + m))
-        eps_fn = lambda x, y: 1 - compute_pr_x_ge_y(x, y)
-        eps_orig = eps_fn(sample1, sample2)
-        for _ in range(1000):
-            bs1 = np.random.choice(sample1, n)
-            bs2 = np.random.choice(sample2, m)
-            epsilons.append(c * (eps_fn(bs1, bs2) - eps_orig))
+        eps_orig = 1 - compute_pr_x_ge_y(sample1, sample2)
+        rng = self.get_rng(rng)
+        bs1 = rng.choice(sample1, (1000, n))
+        bs2 = rng.choice(sample2, (1000, m))
+        epsilons = c * (1 - compute_pr_x_ge_y_batch(bs1, bs2) - eps_orig)
         min_eps = eps_orig - (1 / c) * np.std(epsilons) * phi
         return min_eps < self.options.get('threshold', 0.5), min_eps, alpha
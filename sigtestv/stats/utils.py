@@ -1,52 +1,143 @@
 import numpy as np
 
+from .sample import HistogramSample, as_histogram_sample
+
 
 def compute_pr_x_ge_y(x, y):
-    x = [(x_, 0) for x_ in x]
-    y = [(y_, 1) for y_ in y]
-    z = sorted(y + x, key=lambda e: e[0])
-    counter = 0
-    results = []
-    for idx, (elem, lab) in enumerate(z):
-        counter += lab
-        results.append(counter * (1 - lab))
-    return np.sum(results) / (len(x) * len(y))
+    if isinstance(x, HistogramSample) or isinstance(y, HistogramSample):
+        x = as_histogram_sample(x)
+        y = as_histogram_sample(y)
+        y_le = np.concatenate(([0], np.cumsum(y.counts)))[np.searchsorted(y.unique, x.unique, side='right')]
+        return np.sum(x.counts * y_le) / (len(x) * len(y))
+    y = np.sort(y)
+    return np.sum(np.searchsorted(y, x, side='right')) / (len(x) * len(y))
+
+
+def compute_pr_x_ge_y_batch(xs: np.ndarray, ys: np.ndarray):
+    xs = np.atleast_2d(xs)
+    ys = np.atleast_2d(ys)
+    n = xs.shape[-1]
+    m = ys.shape[-1]
+    rows = max(len(xs), len(ys))
+    z = np.concatenate((np.broadcast_to(ys, (rows, m)), np.broadcast_to(xs, (rows, n))), -1)
+    order = np.argsort(z, -1, kind='stable')
+    is_y = order < m
+    counter = np.cumsum(is_y, -1)
+    return np.sum(counter * ~is_y, -1) / (n * m)
 
 
 def pos_mean_ecdf(cdf, sample):
     cdf1 = 1 - cdf
-    min_sample = sample[0]
+    min_sample = sample[..., 0]
     a = min_sample
-    delta = sample[1:] - sample[:-1]
-    return a + np.sum(cdf1[:-1] * delta)
+    delta = sample[..., 1:] - sample[..., :-1]
+    return a + np.sum(cdf1[..., :-1] * delta, -1)
 
 
 def ecdf(sample: np.ndarray,
          equality=True,
          sorted=True,
          start_point=False,
-         return_map=False):
-    cdf = []
-    if start_point: cdf.append(0)
-    if not sorted:
-        sample = np.sort(sample)
-    n = len(sample)
-    next_sample = np.concatenate((sample[1:], [None]))
-    last_prob = 0
-    for idx, (s, next_s) in enumerate(zip(sample, next_sample)):
-        if s != next_s:
-            prob = (idx + 1) / n if equality else last_prob
-            last_prob = (idx + 1) / n
-            cdf.append(prob)
-    if equality:
-        cdf.append(1)
-    sample = np.unique(sample)
-    cdf = np.unique(cdf)
+         return_map=False,
+         weights=None):
+    if isinstance(sample, HistogramSample):
+        sample, weights = sample.unique, sample.counts
+    sample = np.asarray(sample)
+    if weights is None:
+        if not sorted:
+            sample = np.sort(sample)
+        n = len(sample)
+        sample, counts = np.unique(sample, return_counts=True)
+    else:
+        sample, inverse = np.unique(sample, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights)
+        n = np.sum(counts)
+    cdf = np.cumsum(counts) / n
+    if not equality:
+        cdf = np.concatenate(([0], cdf[:-1]))
+    elif start_point:
+        cdf = np.concatenate(([0], cdf))
     if return_map:
         return {s: c for s, c in zip(sample, cdf)}
     return cdf, sample
 
 
+def ecdf_batch(samples: np.ndarray, equality=True, sorted=True, normalize=True, weights=None):
+    # With weights (e.g., Poisson bootstrap counts, one row per replicate), the cdf is the cumulative weight instead
+    samples = np.asarray(samples)
+    if not sorted:
+        samples = np.sort(samples, -1)
+    n = samples.shape[-1]
+    idx = np.arange(1, n + 1, dtype=np.int32 if n < 2 ** 31 else np.int64)
+    boundary = samples[..., 1:] != samples[..., :-1]
+    counts = np.empty(samples.shape, dtype=idx.dtype)
+    if equality:
+        counts[..., -1] = n
+        counts[..., :-1] = np.where(boundary, idx[:-1], n)
+        counts = np.flip(np.minimum.accumulate(np.flip(counts, -1), -1), -1)
+    else:
+        counts[..., 0] = 0
+        counts[..., 1:] = np.where(boundary, idx[:-1], 0)
+        counts = np.maximum.accumulate(counts, -1)
+    if weights is not None:
+        weights = np.asarray(weights)
+        shape = np.broadcast_shapes(counts.shape, weights.shape)
+        cum_weights = np.zeros(shape[:-1] + (n + 1,))
+        np.cumsum(np.broadcast_to(weights, shape), -1, out=cum_weights[..., 1:])
+        counts = np.take_along_axis(cum_weights, np.broadcast_to(counts, shape), -1)
+        return (counts / cum_weights[..., -1:] if normalize else counts), samples
+    return (counts / n if normalize else counts), samples
+
+
+def as_generator(rng=None):
+    # Without an explicit generator, derive one from the global state so that np.random.seed still applies
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if rng is None:
+        return np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+    return np.random.default_rng(rng)
+
+
+def subsample_indices(N, n, iters, out=None, max_chunk_elems=2 ** 22, rng=None):
+    # Fills an (iters, n) matrix with rows of distinct indices into range(N) in O(n) work per row. Sparse draws
+    # (n^2 <= N) sample with replacement and redraw the rare rows with a collision; dense draws run a partial
+    # Fisher-Yates shuffle over a chunk of rows on an identity workspace, which is restored by undoing the touched
+    # positions. When a chunk holds fewer rows than there are swap steps, Generator.choice (Floyd's algorithm for
+    # small n / N) is cheaper per row
+    if n > N:
+        raise ValueError('Cannot take a larger subsample than the population without replacement')
+    rng = as_generator(rng)
+    if out is None:
+        out = np.empty((iters, n), dtype=np.intp)
+    if n * n <= N:
+        pending = np.arange(iters)
+        while len(pending):
+            draws = rng.integers(0, N, (len(pending), n))
+            sorted_draws = np.sort(draws, 1)
+            valid = ~np.any(sorted_draws[:, 1:] == sorted_draws[:, :-1], 1)
+            out[pending[valid]] = draws[valid]
+            pending = pending[~valid]
+        return out
+    rows = max(1, min(iters, max_chunk_elems // N))
+    if rows < min(n, iters):
+        for idx in range(iters):
+            out[idx] = rng.choice(N, n, replace=False)
+        return out
+    workspace = np.tile(np.arange(N), (rows, 1))
+    for idx in range(0, iters, rows):
+        size = min(rows, iters - idx)
+        row_idx = np.arange(size)
+        swaps = rng.integers(np.arange(n), N, (size, n))
+        for i in range(n):
+            head = workspace[row_idx, i]
+            workspace[row_idx, i] = workspace[row_idx, swaps[:, i]]
+            workspace[row_idx, swaps[:, i]] = head
+        out[idx:idx + size] = workspace[:size, :n]
+        workspace[row_idx[:, None], swaps] = swaps
+        workspace[:size, :n] = np.arange(n)
+    return out
+
+
 def compute_minimum_sample_power(max_p, alpha=0.95):
     return np.log(1 - alpha) / np.log(1 - max_p)
 
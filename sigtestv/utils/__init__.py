@@ -1,2 +1,3 @@
+from .cache import *
 from .object import *
 from .list import *
\ No newline at end of file
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from functools import cached_property, wraps
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+class DiskArrayCache(object):
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def filename(self, key):
+        return self.path / f'{hashlib.sha1(repr(key).encode()).hexdigest()}.npy'
+
+    def get(self, key):
+        try:
+            return np.load(self.filename(key), allow_pickle=False)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+
+    def put(self, key, arr: np.ndarray):
+        # Write to a temporary file first so that concurrent processes never read a partial array
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, arr, allow_pickle=False)
+        os.replace(tmp_name, self.filename(key))
+
+
+_cache_dir = os.environ.get('SIGTESTV_CACHE_DIR')
+_disk_caches = {}
+
+
+def set_cache_dir(path):
+    global _cache_dir
+    _cache_dir = None if path is None else str(path)
+    _disk_caches.clear()
+
+
+def get_disk_cache(namespace):
+    if _cache_dir is None:
+        return None
+    if namespace not in _disk_caches:
+        _disk_caches[namespace] = DiskArrayCache(Path(_cache_dir) / namespace)
+    return _disk_caches[namespace]
+
+
+def array_digest(x):
+    x = np.ascontiguousarray(x)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{x.dtype.str}{x.shape}'.encode())
+    h.update(x.view(np.uint8) if x.dtype != object else repr(x.tolist()).encode())
+    return h.hexdigest()
+
+
+def cache_key(x):
+    # Sample wrappers (SortedSample, HistogramSample) carry a content digest of their immutable data
+    if isinstance(getattr(type(x), 'digest', None), cached_property):
+        return type(x).__qualname__, x.digest
+    if isinstance(x, np.ndarray) or hasattr(x, '__array__') and hasattr(x, 'dtype'):
+        return 'ndarray', array_digest(np.asarray(x))
+    if hasattr(x, 'options') and isinstance(x.options, dict):
+        options = tuple(sorted((k, cache_key(v)) for k, v in x.options.items() if k != 'rng'))
+        return type(x).__qualname__, options
+    if isinstance(x, (list, tuple)):
+        return type(x).__name__, tuple(map(cache_key, x))
+    try:
+        hash(x)
+        return x
+    except TypeError:
+        return repr(x)
+
+
+def result_nbytes(x):
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    if isinstance(x, (list, tuple)):
+        return sum(map(result_nbytes, x))
+    return 64
+
+
+class ArrayMemo(object):
+
+    def __init__(self, max_bytes=2 ** 28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value, _ = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        nbytes = result_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, entries=len(self.entries), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+
+def array_cache(fn=None, max_bytes=2 ** 28):
+    # Memoize on a content digest of array arguments (and the options of estimator-like objects, e.g. self)
+    if fn is None:
+        return lambda fn: array_cache(fn, max_bytes=max_bytes)
+    memo = ArrayMemo(max_bytes)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = cache_key(args), cache_key(tuple(sorted(kwargs.items())))
+        try:
+            return memo.get(key)
+        except KeyError:
+            pass
+        value = fn(*args, **kwargs)
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        memo.put(key, value)
+        return value
+
+    wrapper.cache = memo
+    wrapper.cache_info = memo.info
+    wrapper.cache_clear = memo.clear
+    return wrapper
@@ -7,7 +7,7 @@ class WrappedObject(object):
         return id(self.x)
 
     def __eq__(self, other):
-        return id(other) == id(self)
+        return isinstance(other, WrappedObject) and other.x is self.x
 
 
 def id_wrap(x):
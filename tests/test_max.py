@@ -0,0 +1,45 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from sigtestv.stats import CorrectedMeanMaxEstimator, QuantileMaxEstimator, MeanMaxEstimator, BackwardEstimator
+
+
+def naive_subsample_max(sample, n):
+    return np.mean([max(c) for c in combinations(sample, n)])
+
+
+def naive_backward_budget(sample, n, alpha):
+    thetahat = MeanMaxEstimator(options=dict(n=n)).estimate_point(sample)
+    for idx in range(len(sample) ** 2):
+        if QuantileMaxEstimator(options=dict(n=idx + 1, quantile=1 - alpha)).estimate_point(sample) >= thetahat:
+            break
+    return idx + 1
+
+
+@pytest.mark.parametrize('n', [1, 3, 6, 9])
+def test_exact_corrected_meanmax_matches_enumeration(rng, n):
+    sample = np.round(rng.random(9), 1)
+    estimator = CorrectedMeanMaxEstimator(dict(n=n, method='exact'))
+    assert np.isclose(estimator.estimate_point(sample), naive_subsample_max(sample, n))
+
+
+@pytest.mark.parametrize('options', [dict(method='exact'),
+                                     dict(method='exact', output_prob=True),
+                                     dict(method='subsample', samples=200)])
+def test_corrected_meanmax_batch_matches_rows(rng, options):
+    # The rows share one generator, so the batch must draw the same subsamples in the same order
+    samples = rng.random((4, 20))
+    estimator = CorrectedMeanMaxEstimator(dict(n=5, **options))
+    batch = estimator.estimate_point_batch(samples, rng=np.random.default_rng(1))
+    row_rng = np.random.default_rng(1)
+    rows = [estimator.estimate_point(sample, rng=row_rng) for sample in samples]
+    np.testing.assert_allclose(batch, rows)
+
+
+@pytest.mark.parametrize('n', [1, 5, 15])
+def test_backward_budget_matches_linear_scan(rng, n):
+    sample = rng.random(15)
+    estimator = BackwardEstimator(dict(n=n, alpha=0.95))
+    assert estimator.estimate_point(sample) == naive_backward_budget(sample, n, 0.95)
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from sigtestv.stats import MannWhitneyUTest
+
+
+@pytest.mark.parametrize('alternative', ['less', 'greater', 'two-sided'])
+@pytest.mark.parametrize('n, m', [(5, 7), (12, 12), (20, 15)])
+def test_mann_whitney_matches_scipy_exact(alternative, n, m):
+    rng = np.random.default_rng(n * m)
+    x = rng.random(n)
+    y = rng.random(m) + 0.2
+    _, _, p = MannWhitneyUTest(dict(alternative=alternative)).test(x, y)
+    expected = stats.mannwhitneyu(x, y, alternative=alternative, method='exact').pvalue
+    assert np.isclose(p, expected)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from sigtestv.stats import ecdf, ecdf_batch, compute_pr_x_ge_y, compute_pr_x_ge_y_batch, subsample_indices
+
+
+def naive_ecdf(sample, equality=True):
+    values = np.unique(sample)
+    return np.array([np.mean(sample <= v) if equality else np.mean(sample < v) for v in values]), values
+
+
+def naive_pr_x_ge_y(x, y):
+    return np.mean([[x_ >= y_ for y_ in y] for x_ in x])
+
+
+@pytest.mark.parametrize('equality', [True, False])
+def test_ecdf_matches_naive(rng, equality):
+    sample = np.round(rng.random(200), 1)
+    cdf, values = ecdf(sample, equality=equality, sorted=False)
+    expected_cdf, expected_values = naive_ecdf(sample, equality=equality)
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_allclose(cdf, expected_cdf)
+
+
+@pytest.mark.parametrize('equality', [True, False])
+def test_ecdf_batch_matches_naive(rng, equality):
+    samples = np.sort(np.round(rng.random((20, 50)), 1), 1)
+    cdfs, _ = ecdf_batch(samples, equality=equality)
+    for sample, cdf in zip(samples, cdfs):
+        expected = [np.mean(sample <= v) if equality else np.mean(sample < v) for v in sample]
+        np.testing.assert_allclose(cdf, expected)
+
+
+def test_compute_pr_x_ge_y_matches_naive(rng):
+    x = np.round(rng.random(60), 1)
+    y = np.round(rng.random(40), 1)
+    assert np.isclose(compute_pr_x_ge_y(x, y), naive_pr_x_ge_y(x, y))
+
+
+def test_compute_pr_x_ge_y_batch_matches_naive(rng):
+    xs = np.round(rng.random((10, 30)), 1)
+    ys = np.round(rng.random((10, 20)), 1)
+    np.testing.assert_allclose(compute_pr_x_ge_y_batch(xs, ys), [naive_pr_x_ge_y(x, y) for x, y in zip(xs, ys)])
+
+
+@pytest.mark.parametrize('N, n', [(10, 3), (10, 10), (50, 10), (1000, 20), (100000, 20), (1000, 40)])
+def test_subsample_indices_are_distinct(rng, N, n):
+    indices = subsample_indices(N, n, 500, max_chunk_elems=2 ** 14, rng=rng)
+    assert indices.shape == (500, n)
+    assert indices.min() >= 0 and indices.max() < N
+    assert all(len(np.unique(row)) == n for row in indices)
+
+
+def test_subsample_indices_are_uniform(rng):
+    # All 12 ordered pairs from range(4) should be equally likely
+    indices = subsample_indices(4, 2, 60000, rng=rng)
+    freqs = np.bincount(indices[:, 0] * 4 + indices[:, 1], minlength=16).reshape(4, 4) / len(indices)
+    assert np.all(np.diag(freqs) == 0)
+    np.testing.assert_allclose(freqs[~np.eye(4, dtype=bool)], 1 / 12, atol=0.01)